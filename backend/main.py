@@ -1,12 +1,17 @@
 # backend/main.py
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Header
 from pydantic import BaseModel
 from typing import List, Optional
 import requests
 from dotenv import load_dotenv
 import os
+import secrets
+import uuid
 
-from utils.image_generator import generate_image
+from utils.image_generator import generate_images
+from utils.scheduler import caller, client_id
+from utils.routing import REQUEST_TIMEOUT, dispatch, pick_model, served_model, stats as routing_stats
+from utils import retention
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -14,6 +19,7 @@ from fastapi.middleware.cors import CORSMiddleware
 load_dotenv()
 OLLAMA_URL = os.getenv("OLLAMA_URL")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # required for destructive /maintenance endpoints
 
 if not OLLAMA_URL or not OLLAMA_MODEL:
     raise RuntimeError("Set OLLAMA_URL and OLLAMA_MODEL in .env")
@@ -51,6 +57,15 @@ app.add_middleware(
 _ensure_dirs()
 app.mount("/outputs", StaticFiles(directory=OUTPUTS_DIR), name="outputs")
 
+# Background disk-quota / TTL sweeper for outputs/ and data/sessions/
+@app.on_event("startup")
+def _start_retention():
+    app.state.retention_stop = retention.start_retention()
+
+@app.on_event("shutdown")
+def _stop_retention():
+    app.state.retention_stop.set()
+
 # -----------------------------
 # Linear story generation models
 # -----------------------------
@@ -66,14 +81,17 @@ class Scene(BaseModel):
 
 class StoryOutput(BaseModel):
     scenes: List[Scene]
+    model: Optional[str] = None  # Ollama model that wrote the story
 
 # Story generation with Mistral via Ollama (existing)
 def call_mistral(prompt: str) -> str:
-    resp = requests.post(
-        OLLAMA_URL,
-        json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
-        timeout=120,
-    )
+    route = pick_model("story")
+    with dispatch(route):
+        resp = requests.post(
+            OLLAMA_URL,
+            json={"model": route.model, "prompt": prompt, "stream": False},
+            timeout=REQUEST_TIMEOUT,
+        )
     resp.raise_for_status()
     data = resp.json()
     if "response" not in data:
@@ -98,12 +116,17 @@ def _public_image_url(request: Request, filename: str) -> str:
 # API Route (existing linear)
 @app.post("/generate_story", response_model=StoryOutput)
 def generate_story(input: StoryInput, request: Request):
+    with caller(client_id(request), "interactive"):
+        return _generate_story(input, request)
+
+def _generate_story(input: StoryInput, request: Request) -> StoryOutput:
     prompt = build_story_prompt(input)
     story = call_mistral(prompt)
 
     raw_parts = story.split("\n\n")
-    scenes: List[Scene] = []
-    scene_index = 1
+    texts: List[str] = []
+    # per-request prefix so concurrent stories don't overwrite each other's images
+    request_prefix = f"story_{uuid.uuid4().hex}"
 
     for part in raw_parts:
         text = part.strip()
@@ -113,12 +136,15 @@ def generate_story(input: StoryInput, request: Request):
         ):
             continue
 
-        image_filename = f"scene_{scene_index}.png"
-        generate_image(prompt=text, output_name=image_filename)
-        scenes.append(Scene(text=text, image_path=_public_image_url(request, image_filename)))
-        scene_index += 1
+        texts.append(text)
 
-    return StoryOutput(scenes=scenes)
+    filenames = [f"{request_prefix}_scene_{i}.png" for i in range(1, len(texts) + 1)]
+    generate_images(prompts=texts, output_names=filenames)
+    scenes = [
+        Scene(text=text, image_path=_public_image_url(request, name))
+        for text, name in zip(texts, filenames)
+    ]
+    return StoryOutput(scenes=scenes, model=served_model())
 
 # -----------------------------------
 # Feature routers (branching, co-creator, export)
@@ -131,6 +157,25 @@ app.include_router(story_router, prefix="/story", tags=["story"])
 app.include_router(coco_router,  prefix="/co",    tags=["co-creator"])
 app.include_router(export_router, prefix="/export", tags=["export"])
 
+@app.get("/maintenance/retention")
+def retention_report():
+    """Last retention sweep (bytes reclaimed, usage vs quota)."""
+    return retention.last_report
+
+@app.post("/maintenance/retention/sweep")
+def retention_sweep(x_admin_token: Optional[str] = Header(default=None)):
+    """Run a sweep now. Deletes files, so it needs ADMIN_TOKEN (disabled when unset)."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(403, "manual sweeps are disabled; set ADMIN_TOKEN")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(401, "invalid admin token")
+    return retention.sweep()
+
+@app.get("/maintenance/routing")
+def routing_report():
+    """Model tiers, observed latency per model and current Ollama queue."""
+    return routing_stats()
+
 @app.get("/")
 def root():
     return {"ok": True, "service": "StoryGen API (HF)"}
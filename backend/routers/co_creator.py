@@ -1,7 +1,9 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from pydantic import BaseModel
 from typing import List
 from utils.text_gen import ask_clarifiers, improve_prompt
+from utils.scheduler import caller, client_id
+from utils.routing import served_model
 
 router = APIRouter()
 
@@ -9,13 +11,15 @@ class PromptIn(BaseModel):
     seed_prompt: str
 
 @router.post("/clarify")
-def clarify(p: PromptIn):
-    return {"questions": ask_clarifiers(p.seed_prompt)}
+def clarify(p: PromptIn, request: Request):
+    with caller(client_id(request), "interactive"):
+        return {"questions": ask_clarifiers(p.seed_prompt), "model": served_model()}
 
 class Answers(BaseModel):
     seed_prompt: str
     answers: List[str]
 
 @router.post("/upgrade")
-def upgrade(a: Answers):
-    return {"prompt": improve_prompt(a.seed_prompt, a.answers)}
+def upgrade(a: Answers, request: Request):
+    with caller(client_id(request), "interactive"):
+        return {"prompt": improve_prompt(a.seed_prompt, a.answers), "model": served_model()}
@@ -1,14 +1,18 @@
 # backend/routers/export.py
-from fastapi import APIRouter, HTTPException
-import os, json, re
-from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+import os, re, glob, json, hashlib, html, uuid, zipfile, zlib, struct
+from urllib.parse import urlencode
+from datetime import datetime, timezone
+from typing import Optional, Iterator, List
+
+from utils.sessions import load_session
+from utils.scheduler import caller, client_id, slot
 
 router = APIRouter()
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 OUTPUT_DIR = os.path.normpath(os.path.join(HERE, "..", "..", "outputs"))
-DATA_DIR = os.path.join(os.path.dirname(HERE), "data")
-SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
 
 # ---------- helpers ----------
 def _pick_unicode_font() -> Optional[str]:
@@ -47,6 +51,60 @@ def _ff_path(p: str) -> str:
     """ffmpeg likes forward slashes even on Windows; also quote via concat file."""
     return p.replace("\\", "/")
 
+def _require_refined(session: dict):
+    """Exports ship full-quality art only; drafts must go through /story/refine first."""
+    pending = [i for i, ok in enumerate(session.get("refined", [])) if not ok]
+    if pending:
+        raise HTTPException(409, f"scenes {pending} are drafts; call /story/refine and retry")
+
+# ---------- export cache ----------
+# Artifacts are named <session>_<key>.<ext>, where key hashes everything the
+# output depends on. Same key -> reuse the file; new key -> old ones are stale.
+# Builds write to <session>_<key>_<build>.* intermediates, unique per request, and
+# only the final os.replace produces a name matching _ARTIFACT_RE.
+_ARTIFACT_RE = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}_[0-9a-f]{20}\.(pdf|mp4)"
+)
+
+def _export_key(session: dict, **params) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps(session.get("beats", []), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    for img in session.get("images", []):
+        try:
+            st = os.stat(img)
+            h.update(f"{img}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+        except OSError:
+            h.update(f"{img}|missing".encode("utf-8"))
+    h.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()[:20]
+
+def _drop_stale(directory: str, session_id: str, keep: str):
+    """Remove finished artifacts of older keys; other builds' intermediates are left alone."""
+    for old in glob.glob(os.path.join(directory, f"{session_id}_*")):
+        name = os.path.basename(old)
+        if name != keep and _ARTIFACT_RE.fullmatch(name):
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+def _remove_quietly(*paths: str):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _export_result(kind: str, path: str, key: str, cached: bool, **params) -> dict:
+    # params go into the download URL so the download can re-derive the key
+    query = f"?{urlencode(params)}" if params else ""
+    return {
+        kind: path,
+        "url": f"/export/file/{kind}/{os.path.basename(path)}{query}",
+        "key": key,
+        "cached": cached,
+    }
+
 # ---------- PDF EXPORT ----------
 @router.post("/pdf")
 def export_pdf(session_id: str):
@@ -56,19 +114,29 @@ def export_pdf(session_id: str):
     except ImportError:
         raise HTTPException(status_code=503, detail="fpdf2 not installed. Run: pip install fpdf2")
 
-    path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-    if not os.path.exists(path):
-        raise HTTPException(404, "session not found")
-
-    with open(path, "r", encoding="utf-8") as f:
-        session = json.load(f)
+    session = load_session(session_id)
+    _require_refined(session)
 
     images = session.get("images", [])
     beats = session.get("beats", [])
 
     pdf_dir = os.path.join(OUTPUT_DIR, "pdf")
     os.makedirs(pdf_dir, exist_ok=True)
-    pdf_path = os.path.join(pdf_dir, f"{session_id}.pdf")
+    key = _export_key(session, kind="pdf")
+    final_path = os.path.join(pdf_dir, f"{session_id}_{key}.pdf")
+    if os.path.exists(final_path):
+        return _export_result("pdf", final_path, key, cached=True)
+    pdf_path = os.path.join(pdf_dir, f"{session_id}_{key}_{uuid.uuid4().hex}.pdf.tmp")
+    try:
+        _write_pdf(pdf_path, beats, images)
+        os.replace(pdf_path, final_path)  # only complete files get the cache name
+    finally:
+        _remove_quietly(pdf_path)
+    _drop_stale(pdf_dir, session_id, keep=os.path.basename(final_path))
+    return _export_result("pdf", final_path, key, cached=False)
+
+def _write_pdf(pdf_path: str, beats: list, images: list):
+    from fpdf import FPDF  # type: ignore
 
     pdf = FPDF(format="A4")
     pdf.set_auto_page_break(auto=True, margin=15)
@@ -128,11 +196,9 @@ def export_pdf(session_id: str):
                         pass
         pdf.output(pdf_path)
 
-    return {"pdf": pdf_path}
-
 # ---------- VIDEO EXPORT (ffmpeg-python) ----------
 @router.post("/video")
-def export_video(session_id: str, fps: int = 24, per_scene_sec: float = 5.0):
+def export_video(session_id: str, request: Request, fps: int = 24, per_scene_sec: float = 5.0):
     # lazy imports so app still boots if these aren't installed yet
     try:
         from gtts import gTTS
@@ -154,64 +220,287 @@ def export_video(session_id: str, fps: int = 24, per_scene_sec: float = 5.0):
             )
     _check_ffmpeg_binary()
 
-    path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-    if not os.path.exists(path):
-        raise HTTPException(404, "session not found")
-
-    with open(path, "r", encoding="utf-8") as f:
-        session = json.load(f)
+    session = load_session(session_id)
+    _require_refined(session)
 
     images = session.get("images", [])
     beats = session.get("beats", [])
     if not images:
         raise HTTPException(400, "no images available; render first")
 
-    # 1) TTS narration
-    narration_text = "\n".join([b.get("text", "") for b in beats])
     video_dir = os.path.join(OUTPUT_DIR, "video")
     os.makedirs(video_dir, exist_ok=True)
-    audio_path = os.path.join(video_dir, f"{session_id}.mp3")
-    tts = gTTS(narration_text)
-    tts.save(audio_path)
-
-    # 2) Build concat list file for images (with per-scene duration)
-    #    Note: concat demuxer ignores 'duration' for the LAST entry, so repeat last file without duration.
-    list_path = os.path.join(video_dir, f"{session_id}_inputs.txt")
-    with open(list_path, "w", encoding="utf-8", newline="\n") as f:
-        for img in images:
-            if not os.path.exists(img):
-                continue
-            f.write(f"file '{_ff_path(img)}'\n")
-            f.write(f"duration {per_scene_sec}\n")
-        # repeat last file once to apply its duration
-        if images:
-            last = images[-1]
-            if os.path.exists(last):
-                f.write(f"file '{_ff_path(last)}'\n")
-
-    # 3) Use ffmpeg to mux video+audio
-    out_path = os.path.join(video_dir, f"{session_id}.mp4")
+    params = {"fps": fps, "per_scene_sec": per_scene_sec}
+    key = _export_key(session, kind="video", **params)
+    final_path = os.path.join(video_dir, f"{session_id}_{key}.mp4")
+    if os.path.exists(final_path):
+        return _export_result("video", final_path, key, cached=True, **params)
+
+    # intermediates are unique per build so concurrent exports never share them
+    stem = os.path.join(video_dir, f"{session_id}_{key}_{uuid.uuid4().hex}")
+    audio_path, list_path, out_path = f"{stem}.mp3", f"{stem}_inputs.txt", f"{stem}.tmp.mp4"
     try:
-        video_in = ffmpeg.input(list_path, format="concat", safe=0)
-        audio_in = ffmpeg.input(audio_path)
-
-        # shortest=1 trims to the shorter of audio/video if they mismatch slightly
-        stream = ffmpeg.output(
-            video_in,
-            audio_in,
-            out_path,
-            vcodec="libx264",
-            acodec="aac",
-            pix_fmt="yuv420p",
-            r=fps,
-            shortest=None,
-            movflags="faststart",
-        )
-        ffmpeg.run(stream, overwrite_output=True)
-    except ffmpeg.Error as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"ffmpeg failed: {e.stderr.decode('utf-8', 'ignore') if hasattr(e, 'stderr') else str(e)}",
+        # 1) TTS narration
+        narration_text = "\n".join([b.get("text", "") for b in beats])
+        # gTTS calls Google's TTS service: gate it like the other backends, below interactive/render work
+        with caller(client_id(request), "export"), slot("tts"):
+            tts = gTTS(narration_text)
+            tts.save(audio_path)
+
+        # 2) Build concat list file for images (with per-scene duration)
+        #    Note: concat demuxer ignores 'duration' for the LAST entry, so repeat last file without duration.
+        with open(list_path, "w", encoding="utf-8", newline="\n") as f:
+            for img in images:
+                if not os.path.exists(img):
+                    continue
+                f.write(f"file '{_ff_path(img)}'\n")
+                f.write(f"duration {per_scene_sec}\n")
+            # repeat last file once to apply its duration
+            if images:
+                last = images[-1]
+                if os.path.exists(last):
+                    f.write(f"file '{_ff_path(last)}'\n")
+
+        # 3) Use ffmpeg to mux video+audio
+        try:
+            video_in = ffmpeg.input(list_path, format="concat", safe=0)
+            audio_in = ffmpeg.input(audio_path)
+
+            # shortest=1 trims to the shorter of audio/video if they mismatch slightly
+            stream = ffmpeg.output(
+                video_in,
+                audio_in,
+                out_path,
+                vcodec="libx264",
+                acodec="aac",
+                pix_fmt="yuv420p",
+                r=fps,
+                shortest=None,
+                movflags="faststart",
+            )
+            ffmpeg.run(stream, overwrite_output=True)
+        except ffmpeg.Error as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"ffmpeg failed: {e.stderr.decode('utf-8', 'ignore') if hasattr(e, 'stderr') else str(e)}",
+            )
+
+        os.replace(out_path, final_path)
+    finally:
+        _remove_quietly(out_path, audio_path, list_path)
+    _drop_stale(video_dir, session_id, keep=os.path.basename(final_path))
+    return _export_result("video", final_path, key, cached=False, **params)
+
+# ---------- EPUB EXPORT (streamed zip) ----------
+EPUB_IMAGE_WIDTH = int(os.getenv("EPUB_IMAGE_WIDTH", "800"))
+
+def _epub_image(src: str, width: int = EPUB_IMAGE_WIDTH) -> Optional[str]:
+    """Resized JPEG variant of a scene image, cached next to the other exports."""
+    if not os.path.exists(src):
+        return None
+    variant_dir = os.path.join(OUTPUT_DIR, "epub")
+    os.makedirs(variant_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(src))[0]
+    dst = os.path.join(variant_dir, f"{stem}_w{width}.jpg")
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src):
+        return dst
+    from PIL import Image
+    with Image.open(src) as im:
+        im = im.convert("RGB")
+        im.thumbnail((width, width * 4))
+        tmp = dst + ".tmp"
+        im.save(tmp, "JPEG", quality=85)
+    os.replace(tmp, dst)
+    return dst
+
+class _ZipStream:
+    """Minimal forward-only zip writer for EPUB.
+
+    Every local header carries the real CRC and sizes (no data descriptors, flag
+    bit 3 clear): small text entries are deflated in memory, and stored files get
+    their CRC from a streaming pre-pass. Readers such as Java's ZipInputStream
+    reject STORED entries with data descriptors, which is what zipfile produces
+    on a non-seekable stream. No zip64: EPUBs stay far below 4 GiB.
+    """
+    def __init__(self):
+        self.offset = 0
+        self._central: List[bytes] = []
+        now = datetime.now()
+        self._dos_time = (now.hour << 11) | (now.minute << 5) | (now.second // 2)
+        self._dos_date = ((now.year - 1980) << 9) | (now.month << 4) | now.day
+
+    def _entry(self, name: str, method: int, crc: int, csize: int, usize: int) -> bytes:
+        raw = name.encode("ascii")
+        fields = (20, 0, method, self._dos_time, self._dos_date, crc, csize, usize, len(raw))
+        header = struct.pack("<IHHHHHIIIHH", 0x04034B50, *fields, 0) + raw
+        self._central.append(
+            struct.pack("<IH", 0x02014B50, 20) + struct.pack("<HHHHHIIIHH", *fields, 0)
+            + struct.pack("<HHHII", 0, 0, 0, 0, self.offset) + raw
         )
+        self.offset += len(header) + csize
+        return header
+
+    def add_bytes(self, name: str, data: bytes, compress: bool = True) -> bytes:
+        crc = zlib.crc32(data)
+        if compress:
+            deflater = zlib.compressobj(6, zlib.DEFLATED, -15)
+            body = deflater.compress(data) + deflater.flush()
+        else:
+            body = data
+        method = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        return self._entry(name, method, crc, len(body), len(data)) + body
+
+    def add_file(self, name: str, path: str) -> Iterator[bytes]:
+        """Store a file uncompressed, streaming it in CHUNK-sized pieces."""
+        crc, size = 0, 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+        yield self._entry(name, zipfile.ZIP_STORED, crc, size, size)
+        with open(path, "rb") as f:
+            sent = 0
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                sent += len(chunk)
+                yield chunk
+        if sent != size:
+            raise RuntimeError(f"{path} changed while being zipped")
+
+    def finish(self) -> bytes:
+        directory = b"".join(self._central)
+        count = len(self._central)
+        return directory + struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, len(directory), self.offset, 0)
+
+def _chapter_xhtml(n: int, text: str, image_name: Optional[str]) -> str:
+    paras = "".join(f"<p>{html.escape(p.strip())}</p>" for p in text.split("\n") if p.strip())
+    img = f'<img src="images/{image_name}" alt="Scene {n}"/>' if image_name else ""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+        f"<head><title>Scene {n}</title></head>"
+        f"<body><section epub:type=\"chapter\"><h2>Scene {n}</h2>{img}{paras}</section></body></html>"
+    )
+
+def _epub_stream(session: dict) -> Iterator[bytes]:
+    beats = session.get("beats", [])
+    images = session.get("images", [])
+    title = html.escape((session.get("config") or {}).get("prompt") or "MistralTales story")
+    book_id = f"urn:uuid:{session.get('session_id') or uuid.uuid4()}"
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    pictures = [_epub_image(images[i]) if i < len(images) else None for i in range(len(beats))]
+
+    manifest = ['<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>']
+    spine, nav = [], []
+    for n, pic in enumerate(pictures, start=1):
+        manifest.append(f'<item id="c{n}" href="chapter_{n}.xhtml" media-type="application/xhtml+xml"/>')
+        if pic:
+            manifest.append(f'<item id="i{n}" href="images/scene_{n}.jpg" media-type="image/jpeg"/>')
+        spine.append(f'<itemref idref="c{n}"/>')
+        nav.append(f'<li><a href="chapter_{n}.xhtml">Scene {n}</a></li>')
+
+    opf = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="bookid">'
+        '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:identifier id="bookid">{book_id}</dc:identifier><dc:title>{title}</dc:title>'
+        f'<dc:language>en</dc:language><meta property="dcterms:modified">{modified}</meta>'
+        f'</metadata><manifest>{"".join(manifest)}</manifest><spine>{"".join(spine)}</spine></package>'
+    )
+    nav_doc = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+        f'<head><title>{title}</title></head><body><nav epub:type="toc"><h1>{title}</h1>'
+        f'<ol>{"".join(nav)}</ol></nav></body></html>'
+    )
+    container = (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">'
+        '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+        "</rootfiles></container>"
+    )
+
+    zf = _ZipStream()
+    # mimetype must come first and uncompressed
+    yield zf.add_bytes("mimetype", b"application/epub+zip", compress=False)
+    yield zf.add_bytes("META-INF/container.xml", container.encode("utf-8"))
+    yield zf.add_bytes("OEBPS/content.opf", opf.encode("utf-8"))
+    yield zf.add_bytes("OEBPS/nav.xhtml", nav_doc.encode("utf-8"))
+    for n, (beat, pic) in enumerate(zip(beats, pictures), start=1):
+        chapter = _chapter_xhtml(n, beat.get("text", ""), f"scene_{n}.jpg" if pic else None)
+        yield zf.add_bytes(f"OEBPS/chapter_{n}.xhtml", chapter.encode("utf-8"))
+        if pic:
+            # JPEG is already compressed: store it
+            yield from zf.add_file(f"OEBPS/images/scene_{n}.jpg", pic)
+    yield zf.finish()  # central directory
+
+@router.api_route("/epub", methods=["GET", "POST"])
+def export_epub(session_id: str):
+    """Stream the story as EPUB 3; nothing is written to disk except cached image variants."""
+    session = load_session(session_id)
+    _require_refined(session)
+    if not session.get("beats"):
+        raise HTTPException(400, "session has no beats")
+    return StreamingResponse(
+        _epub_stream(session),
+        media_type="application/epub+zip",
+        headers={"Content-Disposition": f'attachment; filename="{session_id}.epub"'},
+    )
+
+# ---------- DOWNLOAD (streamed, Range-aware) ----------
+MEDIA_TYPES = {"pdf": "application/pdf", "video": "video/mp4"}
+ARTIFACT_EXT = {"pdf": "pdf", "video": "mp4"}
+CHUNK = 64 * 1024
+
+def _iter_file(path: str, start: int, length: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+@router.get("/file/{kind}/{name}")
+def download_export(kind: str, name: str, request: Request, fps: int = 24, per_scene_sec: float = 5.0):
+    """fps/per_scene_sec (video only) come from the export's URL and must match its key."""
+    # only finished artifacts; never temp files, narration or ffmpeg input lists
+    m = _ARTIFACT_RE.fullmatch(name)
+    if kind not in MEDIA_TYPES or not m or m.group(1) != ARTIFACT_EXT[kind]:
+        raise HTTPException(404, "export not found")
+    # an export is only valid for the session content it was built from
+    session = load_session(name[:36])
+    params = {"fps": fps, "per_scene_sec": per_scene_sec} if kind == "video" else {}
+    if name[37:57] != _export_key(session, kind=kind, **params):
+        raise HTTPException(410, "export is stale: the session changed since; export again")
+    path = os.path.join(OUTPUT_DIR, kind, name)
+    if not os.path.isfile(path):
+        raise HTTPException(404, "export not found")
+
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{os.path.splitext(name)[0]}"',  # name carries the content key
+        "Content-Disposition": f'attachment; filename="{name}"',
+    }
+    start, end = 0, size - 1
+    status = 200
+    m = re.fullmatch(r"bytes=(\d*)-(\d*)", request.headers.get("range", "").strip())
+    if m and (m.group(1) or m.group(2)):
+        if m.group(1):
+            start = int(m.group(1))
+            end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+        else:  # suffix range: last N bytes
+            start = max(0, size - int(m.group(2)))
+        if start > end or start >= size:
+            raise HTTPException(416, "range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
 
-    return {"video": out_path}
+    return StreamingResponse(
+        _iter_file(path, start, end - start + 1),
+        status_code=status,
+        media_type=MEDIA_TYPES[kind],
+        headers=headers,
+    )
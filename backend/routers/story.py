@@ -1,17 +1,20 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
-import os, json, uuid
+import os, json, uuid, asyncio, threading, logging
+import requests
 
 from utils.text_gen import generate_beats, continue_branch
-from utils.orchestrator import render_scenes
+from utils.orchestrator import render_scenes, refine_scene
 from utils.memory import CharacterMemory
-
-HERE = os.path.dirname(os.path.abspath(__file__))
-DATA_DIR = os.path.join(os.path.dirname(HERE), "data")
-SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+from utils.scheduler import caller, client_id
+from utils.sessions import load_session, save_session, public_view, select_fields, delta_since
+from utils.live import hub, session_lock, claim_branch, release_branch
+from utils.routing import served_model
 
 router = APIRouter()
+log = logging.getLogger("story")
 
 class StoryInit(BaseModel):
     prompt: str
@@ -25,19 +28,19 @@ class StoryBranch(BaseModel):
     session_id: str
     choice_idx: int
     step: int
+    version: Optional[int] = None  # session version the choice was made on; stale choices get 409
 
 @router.post("/start")
-def start_story(payload: StoryInit):
-    os.makedirs(SESSIONS_DIR, exist_ok=True)
-
-    beats = generate_beats(
-        prompt=payload.prompt,
-        genre=payload.genre,
-        tone=payload.tone,
-        audience=payload.audience,
-        scenes=payload.scenes,
-        guidance=payload.guidance,
-    )
+def start_story(payload: StoryInit, request: Request):
+    with caller(client_id(request), "interactive"):
+        beats, ctx = generate_beats(
+            prompt=payload.prompt,
+            genre=payload.genre,
+            tone=payload.tone,
+            audience=payload.audience,
+            scenes=payload.scenes,
+            guidance=payload.guidance,
+        )
 
     mem = CharacterMemory()
     mem.bootstrap_from_beats(beats)
@@ -49,55 +52,285 @@ def start_story(payload: StoryInit):
         "beats": beats,
         "images": [],
         "current": 0,
+        # Ollama context for the current beats; branching always continues from here
+        "context": ctx,
     }
 
-    with open(os.path.join(SESSIONS_DIR, f"{session_id}.json"), "w", encoding="utf-8") as f:
-        json.dump(session, f, ensure_ascii=False, indent=2)
+    save_session(session)
+
+    return {"session_id": session_id, "beats": beats, "version": session["version"], "model": served_model()}
+
+def _apply_branch(session_id: str, step: int, choice_idx: int, client: str, version: Optional[int] = None) -> Dict:
+    """Apply one choice. Stale or concurrent choices are rejected up front with 409."""
+    session = load_session(session_id)
+    _check_not_stale(session, step, version)
+    if not claim_branch(session_id):
+        raise HTTPException(409, "another choice for this story is being applied; wait for its update")
+    try:
+        # the claimed branch is the only writer of beats, so this snapshot stays current
+        session = load_session(session_id)
+        _check_not_stale(session, step, version)
+        with caller(client, "interactive"):
+            beats, ctx = continue_branch(
+                base_beats=session["beats"],
+                from_step=step,
+                choice_idx=choice_idx,
+                context=session.get("context"),
+            )
 
-    return {"session_id": session_id, "beats": beats}
+        # re-read under the lock: renders/refines may have saved other fields meanwhile
+        with session_lock(session_id):
+            session = load_session(session_id)
+            prev_version = session.get("version", 0)
+            session["beats"] = beats
+            session["context"] = ctx  # only the newest context is ever resumed
+            save_session(session)
+        # announce only choices that actually landed
+        hub.publish(session_id, {"type": "choice", "step": step, "choice_idx": choice_idx, "by": client})
+        hub.publish(session_id, {"type": "beats", "model": served_model(), **delta_since(session, prev_version)})
+    finally:
+        release_branch(session_id)
+    return session
+
+def _check_not_stale(session: Dict, step: int, version: Optional[int]):
+    if version is not None and version < session.get("version", 0):
+        beat_versions = session.get("beat_versions", [])
+        if step >= len(beat_versions) or beat_versions[step] > version:
+            raise HTTPException(409, f"scene {step} changed after version {version}; refetch and choose again")
 
 @router.post("/branch")
-def branch_story(payload: StoryBranch):
-    path = os.path.join(SESSIONS_DIR, f"{payload.session_id}.json")
-    if not os.path.exists(path):
-        raise HTTPException(404, "session not found")
-
-    with open(path, "r", encoding="utf-8") as f:
-        session = json.load(f)
-
-    beats = continue_branch(
-        base_beats=session["beats"],
-        from_step=payload.step,
-        choice_idx=payload.choice_idx,
+def branch_story(payload: StoryBranch, request: Request):
+    session = _apply_branch(
+        payload.session_id, payload.step, payload.choice_idx, client_id(request), payload.version
     )
-    session["beats"] = beats
+    return {
+        "session_id": payload.session_id,
+        "beats": session["beats"],
+        "version": session["version"],
+        "model": served_model(),
+    }
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(session, f, ensure_ascii=False, indent=2)
+def _beat_versions(session: Dict) -> List[Optional[int]]:
+    return session.get("beat_versions") or [None] * len(session.get("beats", []))
 
-    return {"session_id": payload.session_id, "beats": beats}
+def _discard(paths: List[str]):
+    """Delete rendered images that no longer belong to the session."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
 @router.post("/render")
-def render_session(session_id: str):
-    path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-    if not os.path.exists(path):
-        raise HTTPException(404, "session not found")
+def render_session(session_id: str, request: Request, mode: str = "full"):
+    """mode="draft" renders quick low-res previews; refine the keepers via /refine."""
+    if mode not in ("full", "draft"):
+        raise HTTPException(400, "mode must be 'full' or 'draft'")
+
+    session = load_session(session_id)
+    beats = session["beats"]
+    rendered_versions = _beat_versions(session)
 
-    with open(path, "r", encoding="utf-8") as f:
-        session = json.load(f)
+    draft = mode == "draft"
+
+    def progress(idx: int, path: str):
+        hub.publish(session_id, {
+            "type": "render", "scene": idx, "total": len(beats),
+            "image": f"/outputs/{os.path.basename(path)}", "draft": draft,
+        })
+
+    with caller(client_id(request), "render"):
+        images = render_scenes(session_id=session_id, beats=beats, draft=draft, on_scene=progress)
+
+    # re-read under the lock so branches made while rendering aren't overwritten
+    with session_lock(session_id):
+        session = load_session(session_id)
+        current, versions = session["beats"], _beat_versions(session)
+        # scenes a branch removed meanwhile lose their art; scenes it rewrote keep
+        # it only as a draft, so exports refuse them until /refine re-renders
+        dropped = images[len(current):]
+        images = images[:len(current)]
+        refined = [
+            not draft and versions[i] == rendered_versions[i] and current[i] == beats[i]
+            for i in range(len(images))
+        ]
+        replaced = [p for p in session.get("images", []) if p not in images]
+        prev_version = session.get("version", 0)
+        session["images"] = images
+        session["refined"] = refined
+        save_session(session)
+        hub.publish(session_id, {"type": "fields", **delta_since(session, prev_version)})
+    _discard(dropped + replaced)
+
+    return {
+        "session_id": session_id,
+        "images": images,
+        "refined": session["refined"],
+        "version": session["version"],
+    }
 
-    images = render_scenes(session_id=session_id, beats=session["beats"])
-    session["images"] = images
+# Refine jobs run in the threadpool and never shed, so admit only a few at a time
+REFINE_MAX_JOBS = int(os.getenv("REFINE_MAX_JOBS", "4"))
+_refine_jobs = threading.BoundedSemaphore(REFINE_MAX_JOBS)
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(session, f, ensure_ascii=False, indent=2)
+def _refine_in_background(session_id: str, scenes: List[int], client: str):
+    try:
+        _refine_scenes(session_id, scenes, client)
+    finally:
+        _refine_jobs.release()
 
-    return {"session_id": session_id, "images": images}
+def _refine_scenes(session_id: str, scenes: List[int], client: str):
+    for idx in scenes:
+        snapshot = load_session(session_id)
+        beats = snapshot["beats"]
+        if idx >= len(beats):
+            continue
+        rendered_version = _beat_versions(snapshot)[idx]
+        # already accepted, so queue behind other work rather than shedding it
+        with caller(client, "render", shed=False):
+            image = refine_scene(session_id=session_id, beats=beats, idx=idx)
+
+        # re-read: the session may have changed while we were rendering
+        with session_lock(session_id):
+            session = load_session(session_id)
+            current = session["beats"]
+            # a branch rewrote or removed this scene meanwhile: the art no longer matches
+            if (
+                idx >= len(session.get("images", []))
+                or idx >= len(current)
+                or _beat_versions(session)[idx] != rendered_version
+                or current[idx] != beats[idx]
+            ):
+                unused = image
+            else:
+                prev_version = session.get("version", 0)
+                unused = session["images"][idx]
+                session["images"][idx] = image
+                refined = session.get("refined") or [True] * len(session["images"])
+                refined[idx] = True
+                session["refined"] = refined
+                save_session(session)
+                hub.publish(session_id, {"type": "fields", **delta_since(session, prev_version)})
+        _discard([unused])
+
+@router.post("/refine")
+def refine_session(
+    session_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    scenes: Optional[List[int]] = Query(default=None),
+):
+    """Queue full-quality renders for draft scenes (0-based indices; default: all drafts)."""
+    session = load_session(session_id)
+
+    refined = session.get("refined") or [True] * len(session.get("images", []))
+    wanted = range(len(refined)) if scenes is None else scenes
+    queued = sorted({i for i in wanted if 0 <= i < len(refined) and not refined[i]})
+    if queued:
+        if not _refine_jobs.acquire(blocking=False):
+            raise HTTPException(429, "too many refine jobs running, retry later", headers={"Retry-After": "30"})
+        background_tasks.add_task(_refine_in_background, session_id, queued, client_id(request))
+
+    return {"session_id": session_id, "queued": queued}
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: a list of tags, W/ prefixes ignored, or *."""
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == etag:
+            return True
+    return False
 
 @router.get("/session/{session_id}")
-def get_session(session_id: str):
-    path = os.path.join(SESSIONS_DIR, f"{session_id}.json")
-    if not os.path.exists(path):
-        raise HTTPException(404, "session not found")
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def get_session(session_id: str, request: Request, response: Response, fields: Optional[str] = None):
+    """Supports If-None-Match (ETag = session version) and ?fields=beats[3:],images."""
+    session = load_session(session_id)
+    etag = f'"{session.get("version", 0)}"'
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    view = public_view(session)
+    return select_fields(view, fields) if fields else view
+
+@router.get("/session/{session_id}/delta")
+def get_session_delta(session_id: str, since: int = Query(ge=0)):
+    """Beats/fields changed after version `since` (use the version from a previous fetch)."""
+    return delta_since(load_session(session_id), since)
+
+# ---------- live co-creation ----------
+@router.websocket("/ws/{session_id}")
+async def session_ws(ws: WebSocket, session_id: str):
+    """One snapshot on join, then small events for everyone watching the story.
+
+    Server -> client: {"type": "snapshot" | "choice" | "beats" | "fields" | "render" | "resync" | "error", "seq": n, ...}
+    Client -> server: {"type": "choose", "step": k, "choice_idx": i, "version": v}
+    """
+    await ws.accept()
+    try:
+        # unknown ids must not leave hub state behind
+        await run_in_threadpool(load_session, session_id)
+    except HTTPException:
+        await ws.close(code=4404)
+        return
+    queue = hub.join(session_id)  # join before reading so no event falls in between
+    seq = hub.seq(session_id)
+    try:
+        session = await run_in_threadpool(load_session, session_id)
+    except HTTPException:  # removed in the meantime
+        hub.leave(session_id, queue)
+        await ws.close(code=4404)
+        return
+    client = ws.headers.get("x-client-id") or (ws.client.host if ws.client else "anonymous")
+
+    def reply(event: Dict):
+        # replies go through the same queue so only the pump task writes to the socket
+        try:
+            queue.put_nowait(json.dumps(event, ensure_ascii=False))
+        except asyncio.QueueFull:
+            pass
+
+    async def pump():
+        while True:
+            await ws.send_text(await queue.get())
+
+    await ws.send_json({"type": "snapshot", "seq": seq, **public_view(session)})
+    sender = asyncio.create_task(pump())
+    try:
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None:
+                reply({"type": "error", "detail": "binary frames are not supported; send JSON text"})
+                continue
+            try:
+                msg = json.loads(message["text"])
+            except ValueError:
+                reply({"type": "error", "detail": "message is not valid JSON"})
+                continue
+            if not isinstance(msg, dict) or msg.get("type") != "choose":
+                reply({"type": "error", "detail": "expected {\"type\": \"choose\", ...}"})
+                continue
+            try:
+                step, choice_idx = int(msg["step"]), int(msg["choice_idx"])
+                version = None if msg.get("version") is None else int(msg["version"])
+            except (KeyError, TypeError, ValueError):
+                reply({"type": "error", "detail": "choose needs integer step and choice_idx"})
+                continue
+            try:
+                await run_in_threadpool(_apply_branch, session_id, step, choice_idx, client, version)
+            except HTTPException as e:
+                reply({"type": "error", "status": e.status_code, "detail": e.detail})
+            except requests.RequestException as e:
+                reply({"type": "error", "status": 502, "detail": f"story model unavailable: {e}"})
+            except Exception:
+                log.exception("choice on session %s failed", session_id)
+                reply({"type": "error", "status": 500, "detail": "internal error while applying the choice"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        hub.leave(session_id, queue)
@@ -0,0 +1,22 @@
+# backend/tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# Modules import as `utils.*` / `routers.*` from backend/, like uvicorn main:app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Must be set before utils.image_generator / main are imported
+os.environ.setdefault("IMAGE_PROVIDER", "local")
+os.environ.setdefault("OLLAMA_URL", "http://ollama.invalid/api/generate")
+os.environ.setdefault("OLLAMA_MODEL", "test-model")
+
+
+@pytest.fixture
+def sessions_dir(tmp_path, monkeypatch):
+    """Session storage in a temp dir."""
+    from utils import sessions
+    path = tmp_path / "sessions"
+    monkeypatch.setattr(sessions, "SESSIONS_DIR", str(path))
+    return path
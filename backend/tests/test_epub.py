@@ -0,0 +1,50 @@
+# backend/tests/test_epub.py
+import io
+import struct
+import zipfile
+
+import pytest
+from PIL import Image
+
+from routers import export
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "OUTPUT_DIR", str(tmp_path / "out"))
+    img = tmp_path / "11111111-1111-1111-1111-111111111111_scene_1.png"
+    Image.new("RGB", (1600, 1200), (200, 40, 40)).save(img)
+    return {
+        "session_id": "11111111-1111-1111-1111-111111111111",
+        "config": {"prompt": "A robot & a <flower>"},
+        "beats": [{"text": "First line\nsecond line"}, {"text": "The end."}],
+        "images": [str(img)],
+    }
+
+
+def test_epub_is_valid_zip_without_data_descriptors(session):
+    data = b"".join(export._epub_stream(session))
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None
+    assert zf.namelist()[0] == "mimetype"
+    assert "OEBPS/images/scene_1.jpg" in zf.namelist()
+    for info in zf.infolist():
+        assert not info.flag_bits & 0x08, info.filename
+
+    # local header of the first entry: STORED, real CRC/sizes, no extra field
+    sig, _, flags, method, _, _, crc, csize, usize, nlen, xlen = struct.unpack("<IHHHHHIIIHH", data[:30])
+    assert (sig, flags, method, xlen) == (0x04034B50, 0, 0, 0)
+    assert data[30:30 + nlen] == b"mimetype"
+    assert csize == usize == len(b"application/epub+zip") and crc != 0
+    assert data[38:38 + usize] == b"application/epub+zip"
+
+
+def test_epub_content(session):
+    zf = zipfile.ZipFile(io.BytesIO(b"".join(export._epub_stream(session))))
+    chapter = zf.read("OEBPS/chapter_1.xhtml").decode("utf-8")
+    assert "<p>First line</p><p>second line</p>" in chapter
+    assert 'src="images/scene_1.jpg"' in chapter
+    assert "images/" not in zf.read("OEBPS/chapter_2.xhtml").decode("utf-8")
+    assert "A robot &amp; a &lt;flower&gt;" in zf.read("OEBPS/content.opf").decode("utf-8")
+    assert zf.getinfo("OEBPS/images/scene_1.jpg").compress_type == zipfile.ZIP_STORED
+    assert Image.open(io.BytesIO(zf.read("OEBPS/images/scene_1.jpg"))).width == export.EPUB_IMAGE_WIDTH
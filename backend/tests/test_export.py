@@ -0,0 +1,93 @@
+# backend/tests/test_export.py
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers import export
+from utils.sessions import load_session, save_session
+
+SID = "44444444-4444-4444-4444-444444444444"
+
+
+@pytest.fixture
+def client(sessions_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "OUTPUT_DIR", str(tmp_path / "out"))
+    save_session({"session_id": SID, "beats": [{"text": "Once upon a time."}], "images": []})
+    app = FastAPI()
+    app.include_router(export.router, prefix="/export")
+    return TestClient(app)
+
+
+@pytest.fixture
+def artifact(client):
+    """(url, file bytes) of a fresh PDF export."""
+    body = client.post("/export/pdf", params={"session_id": SID}).json()
+    assert body["cached"] is False
+    with open(body["pdf"], "rb") as f:
+        return body["url"], f.read()
+
+
+def test_unchanged_session_is_a_cache_hit(client, artifact):
+    again = client.post("/export/pdf", params={"session_id": SID}).json()
+    assert again["cached"] is True and again["url"] == artifact[0]
+    assert [n for n in os.listdir(os.path.dirname(again["pdf"]))] == [os.path.basename(again["pdf"])]
+
+
+def test_full_and_ranged_downloads(client, artifact):
+    url, data = artifact
+    size = len(data)
+    full = client.get(url)
+    assert full.status_code == 200 and full.content == data and full.headers["Accept-Ranges"] == "bytes"
+
+    open_ended = client.get(url, headers={"Range": "bytes=10-"})
+    assert open_ended.status_code == 206 and open_ended.content == data[10:]
+    assert open_ended.headers["Content-Range"] == f"bytes 10-{size - 1}/{size}"
+
+    suffix = client.get(url, headers={"Range": "bytes=-16"})
+    assert suffix.status_code == 206 and suffix.content == data[-16:]
+
+    clamped = client.get(url, headers={"Range": f"bytes=0-{size + 100}"})
+    assert clamped.status_code == 206 and clamped.content == data
+
+    beyond = client.get(url, headers={"Range": f"bytes={size}-"})
+    assert beyond.status_code == 416 and beyond.headers["Content-Range"] == f"bytes */{size}"
+
+    # multiple ranges are not supported: the whole file is sent instead
+    multi = client.get(url, headers={"Range": "bytes=0-1,5-6"})
+    assert multi.status_code == 200 and multi.content == data
+
+
+def test_export_goes_stale_when_the_session_changes(client, artifact):
+    session = load_session(SID)
+    session["beats"].append({"text": "The end."})
+    save_session(session)
+    assert client.get(artifact[0]).status_code == 410
+
+
+def test_only_finished_artifacts_are_downloadable(client, artifact):
+    url = artifact[0]
+    assert client.get(url.replace(".pdf", ".mp4")).status_code == 404
+    assert client.get(url + ".tmp").status_code == 404
+    assert client.get(url.replace("/pdf/", "/video/")).status_code == 404
+
+
+def test_drop_stale_spares_other_builds_intermediates(tmp_path):
+    finished = [f"{SID}_{'a' * 20}.mp4", f"{SID}_{'b' * 20}.mp4"]
+    building = [f"{SID}_{'c' * 20}_0123abcd.mp3", f"{SID}_{'c' * 20}_0123abcd_inputs.txt", f"{SID}_{'c' * 20}_0123abcd.tmp.mp4"]
+    for name in finished + building:
+        (tmp_path / name).write_bytes(b"x")
+    export._drop_stale(str(tmp_path), SID, keep=finished[1])
+    assert sorted(os.listdir(tmp_path)) == sorted(finished[1:] + building)
+
+
+def test_video_download_checks_the_export_parameters(client, tmp_path):
+    params = {"fps": 30, "per_scene_sec": 4.0}
+    key = export._export_key(load_session(SID), kind="video", **params)
+    path = tmp_path / "out" / "video" / f"{SID}_{key}.mp4"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"mp4")
+    url = export._export_result("video", str(path), key, cached=False, **params)["url"]
+    assert client.get(url).content == b"mp4"
+    assert client.get(url.split("?")[0]).status_code == 410  # default fps/per_scene_sec -> other key
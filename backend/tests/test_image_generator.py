@@ -0,0 +1,65 @@
+# backend/tests/test_image_generator.py
+import threading
+
+import pytest
+from PIL import Image
+
+from utils import image_generator as ig
+
+
+@pytest.fixture
+def local(tmp_path, monkeypatch):
+    assert isinstance(ig.provider, ig.LocalProvider)
+    monkeypatch.setattr(ig, "OUTPUTS_DIR", str(tmp_path))
+    return ig.provider
+
+
+def test_base_provider_is_abstract():
+    with pytest.raises(TypeError):
+        ig.ImageProvider()
+
+
+def test_paths_follow_prompt_order(local, tmp_path):
+    prompts = [f"scene {i}" for i in range(5)]
+    names = [f"s_{i}.png" for i in range(5)]
+    paths = ig.generate_images(prompts, names)
+    assert paths == [str(tmp_path / n) for n in names]
+    for p in paths:
+        assert Image.open(p).size == (1024, 1024)
+
+
+def test_batches_respect_max_batch(local, monkeypatch):
+    monkeypatch.setattr(local, "max_batch", 3)
+    seen = []
+    lock = threading.Lock()
+    real = local.generate
+
+    def spy(prompts, draft=False):
+        with lock:
+            seen.append(list(prompts))
+        return real(prompts, draft=draft)
+
+    monkeypatch.setattr(local, "generate", spy)
+    prompts = [f"p{i}" for i in range(7)]
+    ig.generate_images(prompts, [f"{p}.png" for p in prompts])
+    assert sorted(len(b) for b in seen) == [1, 3, 3]
+    assert sorted(p for b in seen for p in b) == sorted(prompts)
+
+
+def test_on_image_fires_once_per_scene(local, tmp_path):
+    calls = []
+    prompts = [f"p{i}" for i in range(10)]
+    paths = ig.generate_images(prompts, [f"{p}.png" for p in prompts], on_image=lambda i, p: calls.append((i, p)))
+    assert sorted(calls) == list(enumerate(paths))
+
+
+def test_local_is_deterministic_and_draft_is_small(local, tmp_path):
+    a, b = ig.generate_images(["same", "same"], ["a.png", "b.png"], draft=True)
+    other = ig.generate_image("different", "c.png", draft=True)
+    assert Image.open(a).size == (ig.DRAFT_SIZE, ig.DRAFT_SIZE)
+    assert Image.open(a).tobytes() == Image.open(b).tobytes()
+    assert Image.open(a).tobytes() != Image.open(other).tobytes()
+
+
+def test_empty_prompt_list(local):
+    assert ig.generate_images([], []) == []
@@ -0,0 +1,42 @@
+# backend/tests/test_live.py
+import asyncio
+import threading
+
+from utils import live
+
+
+def test_session_locks_are_dropped_when_unused():
+    with live.session_lock("s1"):
+        assert "s1" in live._locks
+    assert "s1" not in live._locks
+
+
+def test_session_lock_is_exclusive_while_waited_on():
+    inside = []
+
+    def waiter():
+        with live.session_lock("s2"):
+            inside.append(1)
+
+    with live.session_lock("s2"):
+        t = threading.Thread(target=waiter)
+        t.start()
+        t.join(0.1)
+        assert not inside and live._locks["s2"][1] == 2  # same lock, not a fresh one
+    t.join(2)
+    assert inside == [1] and "s2" not in live._locks
+
+
+def test_hub_keeps_no_state_for_sessions_without_viewers():
+    hub = live.Hub()
+
+    async def scenario():
+        hub.publish("s3", {"type": "fields"})  # nobody watching yet
+        q = hub.join("s3")
+        hub.publish("s3", {"type": "fields"})
+        await asyncio.sleep(0)
+        assert hub.seq("s3") == 1 and q.qsize() == 1
+        hub.leave("s3", q)
+
+    asyncio.run(scenario())
+    assert hub.seq("s3") == 0 and not hub._seq and not hub._viewers
@@ -0,0 +1,77 @@
+# backend/tests/test_retention.py
+import os
+
+import pytest
+
+from utils import retention
+
+NOW = 1_000_000_000.0
+HOUR = 3600
+A = "aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa"
+B = "bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb"
+C = "cccccccc-cccc-cccc-cccc-cccccccccccc"
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    sessions, images, exports = tmp_path / "sessions", tmp_path / "outputs", tmp_path / "exports"
+    for d in (sessions, images, exports / "pdf"):
+        d.mkdir(parents=True)
+    monkeypatch.setattr(retention, "SESSIONS_DIR", str(sessions))
+    monkeypatch.setattr(retention, "ARTIFACT_DIRS", [str(images), str(exports)])
+    monkeypatch.setattr(retention, "TTL_SEC", 24 * HOUR)
+    monkeypatch.setattr(retention, "QUOTA_BYTES", 10**9)
+    return sessions, images, exports
+
+
+def _file(path, size=10, age=0.0):
+    path.write_bytes(b"x" * size)
+    os.utime(path, (NOW - age, NOW - age))
+    return path
+
+
+def test_orphaned_artifacts_are_removed(dirs):
+    sessions, images, exports = dirs
+    _file(sessions / f"{A}.json")
+    kept = [_file(images / f"{A}_scene_1_1234.png"), _file(exports / "pdf" / f"{A}_{'0' * 20}.pdf")]
+    orphans = [_file(images / f"{B}_scene_1_1234.png"), _file(exports / "pdf" / f"{B}_{'0' * 20}.pdf")]
+    report = retention.sweep(now=NOW)
+    assert report["orphans"] == 1 and report["reclaimed_bytes"] == 20
+    assert all(p.exists() for p in kept) and not any(p.exists() for p in orphans)
+
+
+def test_story_requests_are_not_orphans(dirs):
+    _, images, _ = dirs
+    story = _file(images / "story_0123abcd_scene_1.png")
+    assert retention.sweep(now=NOW)["orphans"] == 0
+    assert story.exists()
+
+
+def test_unused_owners_expire_as_a_unit(dirs):
+    sessions, images, _ = dirs
+    old = [_file(sessions / f"{A}.json.gz", age=25 * HOUR), _file(images / f"{A}_scene_1_1234.png", age=25 * HOUR)]
+    fresh = [_file(sessions / f"{B}.json", age=HOUR), _file(images / f"{B}_scene_1_1234.png", age=30 * HOUR)]
+    story = _file(images / "story_0123abcd_scene_1.png", age=25 * HOUR)
+    report = retention.sweep(now=NOW)
+    assert report["expired"] == 2
+    assert not any(p.exists() for p in old + [story])
+    assert all(p.exists() for p in fresh)  # the session was used recently, so its old image stays
+
+
+def test_least_recently_used_owners_are_evicted_down_to_quota(dirs, monkeypatch):
+    sessions, images, _ = dirs
+    monkeypatch.setattr(retention, "QUOTA_BYTES", 250)
+    for owner, age in ((A, 3 * HOUR), (B, 2 * HOUR), (C, HOUR)):
+        _file(sessions / f"{owner}.json", size=50, age=age)
+        _file(images / f"{owner}_scene_1_1234.png", size=50, age=age)
+    report = retention.sweep(now=NOW)
+    assert report["evicted"] == 1 and report["used_bytes"] == 200
+    assert sorted(os.listdir(sessions)) == [f"{B}.json", f"{C}.json"]
+    assert not (images / f"{A}_scene_1_1234.png").exists()
+
+
+def test_fonts_are_kept(dirs):
+    _, _, exports = dirs
+    font = _file(exports / f"{A}_DejaVuSans.ttf")
+    retention.sweep(now=NOW)
+    assert font.exists()
@@ -0,0 +1,56 @@
+# backend/tests/test_routing.py
+import pytest
+
+from utils import routing
+
+
+@pytest.fixture(autouse=True)
+def fresh_latency(monkeypatch):
+    monkeypatch.setattr(routing, "_latency", {})
+
+
+def test_tiers_have_separate_queues():
+    main = routing.pick_model("story")
+    with routing.dispatch(main):
+        assert routing.stats()["queue"]["main"]["active"] == 1
+        assert routing.stats()["queue"]["fast"]["active"] == 0
+        # a busy main tier does not count against a fast-tier call
+        assert routing.expected_wait("fast") == 0.0
+
+
+def test_failed_call_records_penalty():
+    route = routing.pick_model("clarify")
+    with pytest.raises(TimeoutError):
+        with routing.dispatch(route):
+            raise TimeoutError
+    assert routing._latency["fast"] == routing.FAILURE_PENALTY_SEC
+
+
+@pytest.fixture
+def busy_main(monkeypatch):
+    """Main tier with a 30s call running and two queued; fast tier load set per test."""
+    fast_load = [(0, 0, 1)]
+    monkeypatch.setattr(
+        routing, "load", lambda backend: (2, 1, 1) if backend == "ollama:main" else fast_load[0]
+    )
+    routing.observe("main", 30.0)
+    return fast_load
+
+
+def test_same_model_never_degrades(busy_main):
+    assert routing.TIERS["fast"] == routing.TIERS["main"]
+    assert routing.pick_model("beats").tier == "main"
+
+
+def test_slow_main_tier_degrades_to_a_smaller_model(busy_main, monkeypatch):
+    monkeypatch.setitem(routing.TIERS, "fast", "small-model")
+    route = routing.pick_model("beats")
+    assert route == ("fast", "small-model")
+    assert routing.served_model() == "small-model"
+
+
+def test_no_degrade_when_the_fast_tier_cannot_meet_the_slo(busy_main, monkeypatch):
+    monkeypatch.setitem(routing.TIERS, "fast", "small-model")
+    busy_main[0] = (8, 1, 1)
+    routing.observe("fast", 10.0)  # 10s * 10 queued = 100s > SLO
+    assert routing.pick_model("story").tier == "main"
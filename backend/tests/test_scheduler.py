@@ -0,0 +1,110 @@
+# backend/tests/test_scheduler.py
+import threading
+import time
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from utils import scheduler
+
+
+@pytest.fixture
+def backend():
+    """A fresh single-slot backend."""
+    name = f"test:{uuid.uuid4().hex[:8]}"
+    scheduler.register_backend(name, 1)
+    return name
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+class Waiters:
+    """Queue callers one at a time behind a held slot and record the grant order."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.order = []
+        self.threads = []
+
+    def add(self, label, client, priority, shed=True):
+        def run():
+            with scheduler.caller(client, priority, shed), scheduler.slot(self.backend):
+                self.order.append(label)
+
+        queued = scheduler.load(self.backend)[0]
+        t = threading.Thread(target=run)
+        t.start()
+        self.threads.append(t)
+        _wait_for(lambda: scheduler.load(self.backend)[0] == queued + 1)
+
+    def join(self):
+        for t in self.threads:
+            t.join(2)
+        assert not any(t.is_alive() for t in self.threads)
+
+
+def test_higher_priority_is_served_first(backend):
+    waiters = Waiters(backend)
+    with scheduler.slot(backend):
+        waiters.add("export", "a", "export")
+        waiters.add("render", "b", "render")
+        waiters.add("interactive", "c", "interactive")
+    waiters.join()
+    assert waiters.order == ["interactive", "render", "export"]
+
+
+def test_clients_take_turns_within_a_priority(backend):
+    waiters = Waiters(backend)
+    with scheduler.slot(backend):
+        for i in range(3):
+            waiters.add(f"a{i}", "a", "render")
+        waiters.add("b0", "b", "render")
+        waiters.add("b1", "b", "render")
+    waiters.join()
+    assert waiters.order == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_full_queue_share_sheds_with_retry_after(backend, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_QUEUE", 4)  # export share 0.25 -> one waiter
+    waiters = Waiters(backend)
+    with scheduler.slot(backend):
+        waiters.add("export", "a", "export")
+        with pytest.raises(HTTPException) as exc, scheduler.caller("b", "export"):
+            with scheduler.slot(backend):
+                pass
+        assert exc.value.status_code == 429
+        assert int(exc.value.headers["Retry-After"]) >= 1
+        waiters.add("interactive", "c", "interactive")  # interactive still has room
+    waiters.join()
+    assert waiters.order == ["interactive", "export"]
+
+
+def test_global_waiter_cap_sheds_across_backends(backend, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_WAITERS", 1)
+    other = f"{backend}:other"
+    scheduler.register_backend(other, 1)
+    waiters = Waiters(backend)
+    with scheduler.slot(backend), scheduler.slot(other):
+        waiters.add("first", "a", "interactive")
+        with pytest.raises(HTTPException) as exc:
+            with scheduler.slot(other):
+                pass
+        assert exc.value.status_code == 429
+    waiters.join()
+
+
+def test_background_callers_are_never_shed(backend, monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_QUEUE", 1)
+    monkeypatch.setattr(scheduler, "MAX_WAITERS", 1)
+    waiters = Waiters(backend)
+    with scheduler.slot(backend):
+        for i in range(3):
+            waiters.add(f"bg{i}", "a", "export", shed=False)
+    waiters.join()
+    assert waiters.order == ["bg0", "bg1", "bg2"]
@@ -0,0 +1,74 @@
+# backend/tests/test_sessions.py
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from routers import story
+from utils import sessions
+
+SID = "33333333-3333-3333-3333-333333333333"
+
+
+def _beats(*texts):
+    return [{"text": t} for t in texts]
+
+
+@pytest.fixture
+def session(sessions_dir):
+    return sessions.save_session({"session_id": SID, "beats": _beats("a", "b", "c", "d", "e"), "images": []})
+
+
+def test_versions_track_changed_beats_and_fields(session):
+    assert session["version"] == 1 and session["beat_versions"] == [1] * 5
+    session["beats"][2] = {"text": "C"}
+    session["current"] = 2
+    session = sessions.save_session(session)
+    assert session["version"] == 2
+    assert session["beat_versions"] == [1, 1, 2, 1, 1]
+    assert session["field_versions"]["current"] == 2 and session["field_versions"]["images"] == 1
+
+    delta = sessions.delta_since(session, 1)
+    assert delta["beats"] == {"2": {"text": "C"}}
+    assert set(delta["fields"]) == {"current"}
+
+
+def test_delta_reports_a_shorter_beat_list(session):
+    session["beats"] = session["beats"][:3]
+    session = sessions.save_session(session)
+    delta = sessions.delta_since(session, 1)
+    assert delta["beat_count"] == 3 and delta["beats"] == {}
+
+
+def test_select_fields(session):
+    view = sessions.public_view(session)
+    assert sessions.select_fields(view, "beats[3:]") == {"version": 1, "beats[3:]": _beats("d", "e")}
+    assert sessions.select_fields(view, "beats[-1],images")["beats[-1]"] == {"text": "e"}
+    for bad in ("beats[9]", "nope", "images[0]", "beats[x]", "context"):
+        with pytest.raises(HTTPException) as exc:
+            sessions.select_fields(view, bad)
+        assert exc.value.status_code == 400, bad
+
+
+def test_storage_is_compact_and_gzip_round_trips(session, sessions_dir, monkeypatch):
+    assert "\n" not in (sessions_dir / f"{SID}.json").read_text()
+    monkeypatch.setattr(sessions, "COMPRESS", True)
+    session["current"] = 1
+    sessions.save_session(session)
+    assert not (sessions_dir / f"{SID}.json").exists()
+    with gzip.open(sessions_dir / f"{SID}.json.gz", "rt") as f:
+        assert json.loads(f.read())["current"] == 1
+    assert sessions.load_session(SID)["version"] == 2
+
+
+@pytest.mark.parametrize("header", ['"1"', 'W/"1"', '"7", W/"1"', "*"])
+def test_if_none_match_gives_304(session, header):
+    app = FastAPI()
+    app.include_router(story.router, prefix="/story")
+    client = TestClient(app)
+    assert client.get(f"/story/session/{SID}", headers={"If-None-Match": header}).status_code == 304
+    resp = client.get(f"/story/session/{SID}", headers={"If-None-Match": '"0", W/"2"'})
+    assert resp.status_code == 200 and resp.headers["ETag"] == '"1"'
+    assert "beat_versions" not in resp.json()
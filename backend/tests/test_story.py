@@ -0,0 +1,97 @@
+# backend/tests/test_story.py
+import os
+
+import pytest
+from fastapi import FastAPI, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from routers import story
+from utils.sessions import load_session, save_session
+
+SID = "22222222-2222-2222-2222-222222222222"
+BEATS = [{"text": "Dawn at the harbour."}, {"text": "A storm rolls in."}]
+
+
+@pytest.fixture
+def session(sessions_dir, tmp_path):
+    draft = tmp_path / f"{SID}_scene_1_draft_aaaa.png"
+    draft.write_bytes(b"draft")
+    return save_session({"session_id": SID, "beats": list(BEATS), "images": [str(draft)], "refined": [False]})
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(story.router, prefix="/story")
+    return TestClient(app)
+
+
+def _fake_render(tmp_path, during=None):
+    def render(session_id, beats, idx=None, **kwargs):
+        if during:
+            during()
+        count = 1 if idx is not None else len(beats)
+        paths = []
+        for i in range(count):
+            path = tmp_path / f"{session_id}_scene_{i + 1}_{os.urandom(4).hex()}.png"
+            path.write_bytes(b"art")
+            paths.append(str(path))
+        return paths[0] if idx is not None else paths
+    return render
+
+
+def _branch_scene_0():
+    session = load_session(SID)
+    session["beats"][0] = {"text": "Midnight at the harbour."}
+    save_session(session)
+
+
+def test_refine_replaces_the_draft(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(story, "refine_scene", _fake_render(tmp_path))
+    story._refine_scenes(SID, [0], "tester")
+    after = load_session(SID)
+    assert after["refined"] == [True]
+    assert after["images"][0] != session["images"][0] and os.path.exists(after["images"][0])
+    assert not os.path.exists(session["images"][0])  # the replaced draft is cleaned up
+
+
+def test_refine_for_a_rewritten_scene_is_discarded(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(story, "refine_scene", _fake_render(tmp_path, during=_branch_scene_0))
+    story._refine_scenes(SID, [0], "tester")
+    after = load_session(SID)
+    assert after["images"] == session["images"] and after["refined"] == [False]
+    assert os.path.exists(session["images"][0])
+    assert sorted(os.listdir(tmp_path)) == sorted(["sessions", os.path.basename(session["images"][0])])
+
+
+def test_render_marks_scenes_rewritten_meanwhile_as_drafts(session, tmp_path, client, monkeypatch):
+    monkeypatch.setattr(story, "render_scenes", _fake_render(tmp_path, during=_branch_scene_0))
+    body = client.post("/story/render", params={"session_id": SID}).json()
+    assert body["refined"] == [False, True]
+    assert load_session(SID)["images"] == body["images"]
+    assert not os.path.exists(session["images"][0])
+
+
+def test_ws_unknown_session_is_closed_without_hub_state(sessions_dir, client):
+    missing = "99999999-9999-9999-9999-999999999999"
+    with pytest.raises(WebSocketDisconnect) as exc:
+        with client.websocket_connect(f"/story/ws/{missing}") as ws:
+            ws.receive_json()
+    assert exc.value.code == 4404
+    assert missing not in story.hub._seq
+
+
+def test_ws_bad_frames_and_failures_become_error_events(session, client, monkeypatch):
+    def boom(*args):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(story, "_apply_branch", boom)
+    with client.websocket_connect(f"/story/ws/{SID}") as ws:
+        assert ws.receive_json()["type"] == "snapshot"
+        ws.send_bytes(b"\x00")
+        assert "binary" in ws.receive_json()["detail"]
+        ws.send_text("{not json")
+        assert ws.receive_json()["type"] == "error"
+        ws.send_json({"type": "choose", "step": 0, "choice_idx": 1})
+        assert ws.receive_json()["status"] == 500
+    assert SID not in story.hub._seq
@@ -0,0 +1,66 @@
+# backend/tests/test_text_gen.py
+import json
+
+import pytest
+import requests
+
+from utils import text_gen
+
+BEATS = [{"text": "A lighthouse keeper finds a map.", "choices": ["Follow it", "Burn it"]}]
+NEW_BEATS = BEATS + [{"text": "The map leads to the sea.", "choices": ["Dive", "Sail"]}]
+
+
+@pytest.fixture
+def posts(monkeypatch):
+    """Record every payload sent to Ollama and answer with NEW_BEATS."""
+    monkeypatch.setattr(text_gen, "OLLAMA_NUM_CTX", 4096)
+    sent = []
+
+    def fake_post(route, payload):
+        sent.append(payload)
+        return {"response": json.dumps(NEW_BEATS), "context": [7, 8, 9]}
+
+    monkeypatch.setattr(text_gen, "_post", fake_post)
+    return sent
+
+
+def _context(**overrides):
+    entry = {"model": text_gen.pick_model("branch").model, "num_ctx": 4096, "tokens": [1, 2, 3]}
+    return {**entry, **overrides}
+
+
+def test_matching_context_sends_only_the_instruction(posts):
+    beats, ctx = text_gen.continue_branch(BEATS, 0, 1, context=_context())
+    assert beats == NEW_BEATS
+    assert ctx == {"model": _context()["model"], "num_ctx": 4096, "tokens": [7, 8, 9]}
+    (payload,) = posts
+    assert payload["context"] == [1, 2, 3]
+    assert "lighthouse" not in payload["prompt"]
+
+
+@pytest.mark.parametrize("case", ["missing", "empty", "model", "num_ctx", "headroom"])
+def test_unusable_context_falls_back_to_full_prompt(posts, case):
+    context = {
+        "missing": None,
+        "empty": _context(tokens=[]),
+        "model": _context(model="other-model"),
+        "num_ctx": _context(num_ctx=2048),
+        "headroom": _context(tokens=list(range(int(4096 * text_gen.CONTEXT_HEADROOM)))),
+    }[case]
+    text_gen.continue_branch(BEATS, 0, 1, context=context)
+    (payload,) = posts
+    assert "context" not in payload
+    assert "lighthouse" in payload["prompt"]
+
+
+def test_rejected_context_retries_with_full_prompt(posts, monkeypatch):
+    def reject_context(route, payload):
+        posts.append(payload)
+        if "context" in payload:
+            raise requests.HTTPError("context rejected")
+        return {"response": json.dumps(NEW_BEATS)}
+
+    monkeypatch.setattr(text_gen, "_post", reject_context)
+    beats, ctx = text_gen.continue_branch(BEATS, 0, 1, context=_context())
+    assert beats == NEW_BEATS and ctx is None
+    assert [("context" in p, "lighthouse" in p["prompt"]) for p in posts] == [(True, False), (False, True)]
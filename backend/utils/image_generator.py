@@ -1,32 +1,162 @@
 # backend/utils/image_generator.py
+"""Image generation behind a small provider interface.
+
+IMAGE_PROVIDER picks the backend:
+  - "hf"    : Hugging Face InferenceClient (default; one prompt per request)
+  - "local" : deterministic placeholder art, no network (tests / benchmarks)
+
+Each provider has its own batch size, concurrency and timeout, overridable with
+IMAGE_BATCH_SIZE / IMAGE_CONCURRENCY / IMAGE_TIMEOUT, and its own scheduler
+backend ("image:<name>") so admission control sees the real capacity.
+"""
+import hashlib
 import os
-from huggingface_hub import InferenceClient
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from typing import Callable, List, Optional
+
 from dotenv import load_dotenv
 from PIL import Image
 
+from utils.scheduler import slot, register_backend
+
 # Load variables from .env
 load_dotenv()
 
 # Load HF token from env
 HF_TOKEN = os.getenv("HF_TOKEN")
 
-client = InferenceClient(
-    model="stabilityai/stable-diffusion-xl-base-1.0",
-    token=HF_TOKEN,
-    provider="nscale",
-)
-
 # ✅ Resolve to backend/outputs no matter where the process is started
 HERE = os.path.dirname(os.path.abspath(__file__))         # .../backend/utils
 OUTPUTS_DIR = os.path.normpath(os.path.join(HERE, "..", "outputs"))  # .../backend/outputs
 os.makedirs(OUTPUTS_DIR, exist_ok=True)
 
-def generate_image(prompt: str, output_name: str = "output.png") -> str:
-    image: Image.Image = client.text_to_image(
-        prompt,
-        guidance_scale=7,
-        num_inference_steps=30,
-    )
-    path = os.path.join(OUTPUTS_DIR, output_name)
-    image.save(path)
-    return path  # absolute filesystem path
+# Full quality vs. quick draft settings (drafts are for browsing branches)
+FULL_STEPS = 30
+DRAFT_STEPS = int(os.getenv("DRAFT_STEPS", "8"))
+DRAFT_SIZE = int(os.getenv("DRAFT_SIZE", "512"))
+
+
+class ImageProvider(ABC):
+    """Turns a batch of prompts into images. Subclasses set the capacity knobs."""
+    name = "base"
+    max_batch = 1       # prompts per request the backend accepts
+    concurrency = 1     # requests in flight at once
+    timeout = 120.0     # seconds per request
+
+    def configure(self):
+        self.max_batch = int(os.getenv("IMAGE_BATCH_SIZE") or self.max_batch)
+        self.concurrency = int(os.getenv("IMAGE_CONCURRENCY") or self.concurrency)
+        self.timeout = float(os.getenv("IMAGE_TIMEOUT") or self.timeout)
+        register_backend(f"image:{self.name}", self.concurrency)
+        return self
+
+    @abstractmethod
+    def generate(self, prompts: List[str], draft: bool = False) -> List[Image.Image]:
+        """One image per prompt, in order."""
+
+
+class HFProvider(ImageProvider):
+    name = "hf"
+    concurrency = 2
+
+    def __init__(self):
+        self._client = None
+
+    @property
+    def client(self):
+        # created on first use so importing this module never needs a token or network
+        if self._client is None:
+            from huggingface_hub import InferenceClient
+            self._client = InferenceClient(
+                model=os.getenv("HF_IMAGE_MODEL", "stabilityai/stable-diffusion-xl-base-1.0"),
+                token=HF_TOKEN,
+                provider=os.getenv("HF_IMAGE_PROVIDER", "nscale"),
+                timeout=self.timeout,
+            )
+        return self._client
+
+    def configure(self):
+        super().configure()
+        self.max_batch = 1  # text_to_image takes a single prompt
+        return self
+
+    def generate(self, prompts: List[str], draft: bool = False) -> List[Image.Image]:
+        extra = {"width": DRAFT_SIZE, "height": DRAFT_SIZE} if draft else {}
+        return [
+            self.client.text_to_image(
+                p,
+                guidance_scale=7,
+                num_inference_steps=DRAFT_STEPS if draft else FULL_STEPS,
+                **extra,
+            )
+            for p in prompts
+        ]
+
+
+class LocalProvider(ImageProvider):
+    """Same prompt -> same picture: a colour field derived from the prompt hash."""
+    name = "local"
+    max_batch = 8
+    concurrency = 4
+
+    def generate(self, prompts: List[str], draft: bool = False) -> List[Image.Image]:
+        size = DRAFT_SIZE if draft else 1024
+        images = []
+        for p in prompts:
+            digest = hashlib.sha256(p.encode("utf-8")).digest()
+            img = Image.new("RGB", (size, size), tuple(digest[:3]))
+            img.paste(tuple(digest[3:6]), (size // 4, size // 4, 3 * size // 4, 3 * size // 4))
+            images.append(img)
+        return images
+
+
+PROVIDERS = {"hf": HFProvider, "local": LocalProvider}
+
+
+def _make_provider() -> ImageProvider:
+    name = os.getenv("IMAGE_PROVIDER", "hf").lower()
+    if name not in PROVIDERS:
+        raise RuntimeError(f"IMAGE_PROVIDER must be one of {sorted(PROVIDERS)}, got {name!r}")
+    return PROVIDERS[name]().configure()
+
+
+provider = _make_provider()
+
+
+def generate_images(
+    prompts: List[str],
+    output_names: List[str],
+    draft: bool = False,
+    on_image: Optional[Callable[[int, str], None]] = None,
+) -> List[str]:
+    """Render prompts in provider-sized batches, up to `concurrency` batches at once.
+
+    Returns absolute paths in prompt order; on_image(idx, path) fires as each lands.
+    """
+    backend = f"image:{provider.name}"
+    paths: List[Optional[str]] = [None] * len(prompts)
+    batches = [range(i, min(i + provider.max_batch, len(prompts))) for i in range(0, len(prompts), provider.max_batch)]
+
+    def run(batch: range) -> range:
+        with slot(backend):
+            images = provider.generate([prompts[i] for i in batch], draft=draft)
+        for i, image in zip(batch, images):
+            path = os.path.join(OUTPUTS_DIR, output_names[i])
+            image.save(path)
+            paths[i] = path
+        return batch
+
+    with ThreadPoolExecutor(max_workers=max(1, min(provider.concurrency, len(batches)))) as pool:
+        # copy_context so the scheduler still sees the caller's client/priority in worker threads
+        futures = [pool.submit(copy_context().run, run, b) for b in batches]
+        for fut in as_completed(futures):
+            for i in fut.result():
+                if on_image:
+                    on_image(i, paths[i])
+    return paths  # type: ignore[return-value]
+
+
+def generate_image(prompt: str, output_name: str = "output.png", draft: bool = False) -> str:
+    return generate_images([prompt], [output_name], draft=draft)[0]  # absolute filesystem path
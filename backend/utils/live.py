@@ -0,0 +1,112 @@
+# backend/utils/live.py
+"""Fan-out of session events to WebSocket viewers (multiplayer co-creation).
+
+Sync endpoints run in the threadpool, so `hub.publish` is thread-safe: it stamps
+the event with a per-session sequence number, encodes it once and hands it to
+the event loop, which drops the text into every viewer's bounded queue. A
+viewer that falls behind gets its backlog replaced by a single "resync" event
+(it should refetch via GET /story/session/{id}/delta) instead of slowing others.
+
+`session_lock` guards the short load-modify-save of a session file; never hold
+it across a model call. Per-session state (locks, sequence numbers) only exists
+while someone uses it, so a long-running server doesn't grow with every id seen. Choices are ordered with `claim_branch`: one branch per
+session is in flight at a time and any choice arriving meanwhile is rejected
+immediately, instead of parking a threadpool worker for a whole generation.
+"""
+import asyncio
+import json
+import os
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set
+
+VIEWER_QUEUE = int(os.getenv("LIVE_VIEWER_QUEUE", "64"))
+
+_locks: Dict[str, List] = {}  # session -> [lock, holders + waiters]
+_locks_guard = threading.Lock()
+_branching: Set[str] = set()  # sessions with a branch in flight
+
+
+@contextmanager
+def session_lock(session_id: str):
+    """Hold the session's lock; it is dropped again once nobody holds or awaits it."""
+    with _locks_guard:
+        entry = _locks.setdefault(session_id, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _locks[session_id]
+
+
+def claim_branch(session_id: str) -> bool:
+    """Mark a branch in flight for `session_id`; False if one already is."""
+    with _locks_guard:
+        if session_id in _branching:
+            return False
+        _branching.add(session_id)
+        return True
+
+
+def release_branch(session_id: str):
+    with _locks_guard:
+        _branching.discard(session_id)
+
+
+class Hub:
+    def __init__(self):
+        self._viewers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+        self._seq: Dict[str, int] = {}  # only for sessions with viewers
+        self._guard = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def join(self, session_id: str) -> asyncio.Queue:
+        """Register a viewer; must be called from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        q: asyncio.Queue = asyncio.Queue(maxsize=VIEWER_QUEUE)
+        with self._guard:
+            self._viewers[session_id].add(q)
+            self._seq.setdefault(session_id, 0)
+        return q
+
+    def leave(self, session_id: str, q: asyncio.Queue):
+        with self._guard:
+            viewers = self._viewers.get(session_id)
+            if viewers is not None:
+                viewers.discard(q)
+                if not viewers:
+                    del self._viewers[session_id]
+                    self._seq.pop(session_id, None)
+
+    def viewers(self, session_id: str) -> int:
+        return len(self._viewers.get(session_id, ()))
+
+    def seq(self, session_id: str) -> int:
+        return self._seq.get(session_id, 0)
+
+    def publish(self, session_id: str, event: Dict):
+        """Broadcast `event` to everyone watching `session_id` (any thread)."""
+        with self._guard:
+            if self._loop is None or session_id not in self._viewers:
+                return  # nobody to tell; a joining viewer starts from a snapshot
+            self._seq[session_id] += 1
+            seq = self._seq[session_id]
+        text = json.dumps({**event, "seq": seq}, ensure_ascii=False)
+        self._loop.call_soon_threadsafe(self._fanout, session_id, text, seq)
+
+    def _fanout(self, session_id: str, text: str, seq: int):
+        for q in list(self._viewers.get(session_id, ())):
+            try:
+                q.put_nowait(text)
+            except asyncio.QueueFull:
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(json.dumps({"type": "resync", "seq": seq}))
+
+
+hub = Hub()
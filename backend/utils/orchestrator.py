@@ -1,7 +1,8 @@
 # backend/utils/orchestrator.py
 import os
-from typing import List, Dict
-from utils.image_generator import generate_image
+import uuid
+from typing import List, Dict, Callable, Optional
+from utils.image_generator import generate_image, generate_images
 
 STYLE_HINT = "illustration, cinematic composition, SDXL quality, vivid lighting, storybook"
 
@@ -9,11 +10,33 @@ def _scene_prompt(beat: Dict) -> str:
     base = beat.get("text", "")
     return f"{base}\n\nIllustration style: {STYLE_HINT}"
 
-def render_scenes(session_id: str, beats: List[Dict]) -> List[str]:
-    paths: List[str] = []
-    for i, beat in enumerate(beats, start=1):
-        prompt = _scene_prompt(beat)
-        filename = f"{session_id}_scene_{i}.png"
-        path = generate_image(prompt=prompt, output_name=filename)
-        paths.append(path)  # absolute filesystem paths; frontend uses basename to build /outputs URLs
-    return paths
+def _scene_filename(session_id: str, i: int, run: str, draft: bool = False) -> str:
+    # a fresh `run` per render: files already in a session are never overwritten,
+    # so a render that turns out stale can simply be deleted
+    return f"{session_id}_scene_{i}{'_draft' if draft else ''}_{run}.png"
+
+def render_scenes(
+    session_id: str,
+    beats: List[Dict],
+    draft: bool = False,
+    on_scene: Optional[Callable[[int, str], None]] = None,
+) -> List[str]:
+    """on_scene(idx, path) is called as each scene (0-based) lands, for progress reporting."""
+    run = uuid.uuid4().hex[:8]
+    # absolute filesystem paths; frontend uses basename to build /outputs URLs
+    return generate_images(
+        prompts=[_scene_prompt(b) for b in beats],
+        output_names=[_scene_filename(session_id, i, run, draft) for i in range(1, len(beats) + 1)],
+        draft=draft,
+        on_image=on_scene,
+    )
+
+def refine_scene(session_id: str, beats: List[Dict], idx: int) -> str:
+    """Full-quality render of a single scene (0-based idx) to a new file.
+
+    The caller decides whether it replaces the scene's current image.
+    """
+    return generate_image(
+        prompt=_scene_prompt(beats[idx]),
+        output_name=_scene_filename(session_id, idx + 1, uuid.uuid4().hex[:8]),
+    )
@@ -0,0 +1,139 @@
+# backend/utils/retention.py
+"""Disk retention for generated artifacts.
+
+Every artifact name starts with its owner: a session id (`<uuid>_scene_1.png`,
+`pdf/<uuid>.pdf`, `video/<uuid>_inputs.txt`, ...) or a one-off story request
+(`story_<hex>_scene_1.png`). A sweep groups files by owner and
+
+1. removes session artifacts whose session JSON is gone (orphans),
+2. removes owners not used for RETENTION_TTL_HOURS,
+3. evicts least-recently-used owners until usage is under RETENTION_QUOTA_MB.
+
+Owners are evicted as a unit so we never keep a session without its images.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+log = logging.getLogger("retention")
+
+HERE = os.path.dirname(os.path.abspath(__file__))          # .../backend/utils
+BACKEND_DIR = os.path.dirname(HERE)
+SESSIONS_DIR = os.path.join(BACKEND_DIR, "data", "sessions")
+# images live in backend/outputs, exports in <repo>/outputs (see routers/export.py)
+ARTIFACT_DIRS = [
+    os.path.join(BACKEND_DIR, "outputs"),
+    os.path.normpath(os.path.join(BACKEND_DIR, "..", "outputs")),
+]
+
+QUOTA_BYTES = int(float(os.getenv("RETENTION_QUOTA_MB", "2048")) * 1024 * 1024)
+TTL_SEC = float(os.getenv("RETENTION_TTL_HOURS", "168")) * 3600
+INTERVAL_SEC = float(os.getenv("RETENTION_INTERVAL_SEC", "600"))
+
+_OWNER_RE = re.compile(r"^(story_[0-9a-f]+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})")
+# files we must never delete even though they sit in outputs/
+_KEEP = {".ttf"}
+
+last_report: Dict = {}
+
+
+def _owner(filename: str) -> Optional[str]:
+    m = _OWNER_RE.match(filename)
+    return m.group(1) if m else None
+
+
+def _scan() -> Dict[str, Dict]:
+    """owner -> {"files": [(path, size)], "bytes": int, "last_used": float, "session": bool}"""
+    owners: Dict[str, Dict] = {}
+
+    def add(owner: str, path: str, is_session: bool = False):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        g = owners.setdefault(owner, {"files": [], "bytes": 0, "last_used": 0.0, "session": False})
+        g["files"].append((path, st.st_size))
+        g["bytes"] += st.st_size
+        g["last_used"] = max(g["last_used"], st.st_mtime, st.st_atime)
+        g["session"] = g["session"] or is_session
+
+    if os.path.isdir(SESSIONS_DIR):
+        for name in os.listdir(SESSIONS_DIR):
+            owner = _owner(name)
+            if owner:
+                add(owner, os.path.join(SESSIONS_DIR, name), is_session=name in (f"{owner}.json", f"{owner}.json.gz"))
+
+    for root in ARTIFACT_DIRS:
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                owner = _owner(name)
+                if owner and os.path.splitext(name)[1] not in _KEEP:
+                    add(owner, os.path.join(dirpath, name))
+    return owners
+
+
+def _remove(files: List) -> int:
+    freed = 0
+    for path, size in files:
+        try:
+            os.remove(path)
+            freed += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning("retention: could not remove %s: %s", path, e)
+    return freed
+
+
+def sweep(now: Optional[float] = None) -> Dict:
+    """Run one retention pass and return what was reclaimed."""
+    global last_report
+    now = now or time.time()
+    owners = _scan()
+    report = {"orphans": 0, "expired": 0, "evicted": 0, "reclaimed_bytes": 0}
+
+    for owner, g in list(owners.items()):
+        reason = None
+        if not owner.startswith("story_") and not g["session"]:
+            reason = "orphans"
+        elif now - g["last_used"] > TTL_SEC:
+            reason = "expired"
+        if reason:
+            report["reclaimed_bytes"] += _remove(g["files"])
+            report[reason] += 1
+            del owners[owner]
+
+    used = sum(g["bytes"] for g in owners.values())
+    for owner, g in sorted(owners.items(), key=lambda kv: kv[1]["last_used"]):
+        if used <= QUOTA_BYTES:
+            break
+        freed = _remove(g["files"])
+        used -= g["bytes"]
+        report["reclaimed_bytes"] += freed
+        report["evicted"] += 1
+
+    report["used_bytes"] = used
+    report["quota_bytes"] = QUOTA_BYTES
+    report["finished_at"] = now
+    last_report = report
+    if report["reclaimed_bytes"]:
+        log.info("retention: reclaimed %d bytes (%s)", report["reclaimed_bytes"], report)
+    return report
+
+
+def _loop(stop: threading.Event):
+    while not stop.wait(INTERVAL_SEC):
+        try:
+            sweep()
+        except Exception:
+            log.exception("retention sweep failed")
+
+
+def start_retention() -> threading.Event:
+    """Start the background sweeper; set the returned event to stop it."""
+    stop = threading.Event()
+    threading.Thread(target=_loop, args=(stop,), daemon=True, name="retention").start()
+    return stop
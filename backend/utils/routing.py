@@ -0,0 +1,119 @@
+# backend/utils/routing.py
+"""Pick an Ollama model per call type, falling back to the fast tier under load.
+
+Call types map to a tier ("fast" or "main"). Each tier has its own scheduler
+backend ("ollama:fast" / "ollama:main") and limit, so short clarifier calls
+never queue behind long branch generations. Before each call we estimate the
+wait on the tier from its observed latency and its own queue; if that would
+blow the call type's SLO we serve it from the fast tier instead, but only when
+that is a different model and its own queue is both shorter and within the SLO.
+Moving a call to the same model on another queue would just add a concurrent
+generation and make short calls wait behind it. The model that actually served
+the call is kept in a context var so endpoints can report it (`served_model()`).
+
+OLLAMA_FAST_MODEL defaults to OLLAMA_MODEL; the tiers then differ only in queue
+and never degrade.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, NamedTuple, Optional
+
+from utils.scheduler import load, register_backend, slot
+
+MAIN_MODEL = os.getenv("OLLAMA_MODEL")
+FAST_MODEL = os.getenv("OLLAMA_FAST_MODEL") or MAIN_MODEL
+TIERS = {"fast": FAST_MODEL, "main": MAIN_MODEL}
+
+register_backend("ollama:main", int(os.getenv("OLLAMA_CONCURRENCY", "1")))
+register_backend("ollama:fast", int(os.getenv("OLLAMA_FAST_CONCURRENCY", "1")))
+
+REQUEST_TIMEOUT = 120  # seconds, per Ollama request
+# A failed call (timeout, refused connection) counts as at least this slow
+FAILURE_PENALTY_SEC = float(os.getenv("ROUTE_FAILURE_PENALTY_SEC", str(REQUEST_TIMEOUT)))
+
+# call type -> (tier, latency SLO in seconds)
+ROUTES: Dict[str, tuple] = {
+    "clarify": ("fast", float(os.getenv("SLO_SHORT_SEC", "8"))),
+    "upgrade": ("fast", float(os.getenv("SLO_SHORT_SEC", "8"))),
+    "beats":   ("main", float(os.getenv("SLO_STORY_SEC", "60"))),
+    "branch":  ("main", float(os.getenv("SLO_STORY_SEC", "60"))),
+    "story":   ("main", float(os.getenv("SLO_STORY_SEC", "60"))),
+}
+
+
+class Route(NamedTuple):
+    tier: str
+    model: str
+
+    @property
+    def backend(self) -> str:
+        return f"ollama:{self.tier}"
+
+
+_latency: Dict[str, float] = {}  # tier -> EWMA seconds per call
+_guard = threading.Lock()
+_served: ContextVar[Optional[str]] = ContextVar("served_model", default=None)
+
+
+def expected_wait(tier: str) -> float:
+    """Latency of one call plus the queue ahead of it on this tier's backend.
+
+    An idle backend reports 0: we only degrade under load, and idle calls on the
+    main tier are what keep its latency estimate fresh after a slow spell.
+    """
+    waiting, active, limit = load(f"ollama:{tier}")
+    if not waiting and not active:
+        return 0.0
+    per_call = _latency.get(tier, 0.0)
+    return per_call * (1 + (waiting + active) / limit)
+
+
+def pick_model(call: str) -> Route:
+    tier, slo = ROUTES[call]
+    if tier != "fast" and TIERS["fast"] != TIERS[tier]:
+        wait = expected_wait(tier)
+        if wait > slo and expected_wait("fast") < min(wait, slo):
+            tier = "fast"  # SLO at risk and the faster model can meet it
+    route = Route(tier, TIERS[tier])
+    _served.set(route.model)
+    return route
+
+
+def observe(tier: str, seconds: float):
+    with _guard:
+        prev = _latency.get(tier)
+        _latency[tier] = seconds if prev is None else 0.8 * prev + 0.2 * seconds
+
+
+@contextmanager
+def dispatch(route: Route):
+    """Hold the tier's scheduler slot and record how long the call took.
+
+    Failures are recorded too (at least FAILURE_PENALTY_SEC): timeouts are the
+    clearest overload signal and must push the estimate up, not be skipped.
+    """
+    with slot(route.backend):
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            elapsed = time.monotonic() - start
+            observe(route.tier, elapsed if ok else max(elapsed, FAILURE_PENALTY_SEC))
+
+
+def served_model() -> Optional[str]:
+    """Model that served the most recent text call in this request."""
+    return _served.get()
+
+
+def stats() -> Dict:
+    queues = {}
+    for tier in TIERS:
+        waiting, active, limit = load(f"ollama:{tier}")
+        queues[tier] = {"waiting": waiting, "active": active, "limit": limit}
+    return {"tiers": TIERS, "latency_sec": dict(_latency), "queue": queues}
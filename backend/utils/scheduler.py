@@ -0,0 +1,162 @@
+# backend/utils/scheduler.py
+"""Admission control in front of the model backends (Ollama, image provider).
+
+Every backend call takes a slot with `scheduler.slot(<backend>)`. Waiters are
+served by priority class first, then round-robin across clients, so one
+user's 8-scene render can't starve another user's next beat. When a queue is
+too deep we shed with 429 + Retry-After instead of piling up threads.
+
+Endpoints say who is calling with `caller(client, priority)`; the scheduler
+reads that from a context var so utils don't need request plumbing.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Tuple
+
+from fastapi import HTTPException, Request
+
+# Lower number = served first
+PRIORITIES = {"interactive": 0, "render": 1, "export": 2}
+
+# Share of SCHED_MAX_QUEUE each class may fill before it is shed;
+# bulk classes are turned away earlier so interactive calls keep queue room
+QUEUE_SHARE = {"interactive": 1.0, "render": 0.5, "export": 0.25}
+
+# Ollama tiers and image providers register their own backends
+# (see utils/routing.py and utils/image_generator.py)
+LIMITS = {
+    "tts": int(os.getenv("TTS_CONCURRENCY", "2")),
+}
+MAX_QUEUE = int(os.getenv("SCHED_MAX_QUEUE", "32"))
+# Waiters block sync threadpool threads (40 by default in Starlette/anyio), so the
+# total across all backends must stay well below that or the pool itself stalls.
+# Non-shedding (background) waiters are bounded where they are admitted.
+MAX_WAITERS = int(os.getenv("SCHED_MAX_WAITERS", "24"))
+
+_total_waiting = 0
+_total_guard = threading.Lock()
+
+# (client, priority, may_shed)
+_caller: ContextVar[Tuple[str, str, bool]] = ContextVar("caller", default=("anonymous", "interactive", True))
+
+
+def client_id(request: Request) -> str:
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "anonymous")
+
+
+@contextmanager
+def caller(client: str, priority: str, shed: bool = True):
+    """Tag backend calls made inside this block. shed=False for background work."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"unknown priority {priority!r}")
+    token = _caller.set((client, priority, shed))
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+class _Ticket:
+    __slots__ = ("granted",)
+
+    def __init__(self):
+        self.granted = False
+
+
+class _Backend:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self.cond = threading.Condition()
+        # priority -> client -> pending tickets; OrderedDict order is the round-robin
+        self.queues: Dict[int, "OrderedDict[str, Deque[_Ticket]]"] = {
+            p: OrderedDict() for p in PRIORITIES.values()
+        }
+        self.waiting = 0
+        self.avg_service = 5.0  # seconds, EWMA; only used for Retry-After
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self.avg_service * (self.waiting + 1) / self.limit))
+
+    def _dispatch(self):
+        while self.active < self.limit and self.waiting:
+            for prio in sorted(self.queues):
+                clients = self.queues[prio]
+                if not clients:
+                    continue
+                client, tickets = clients.popitem(last=False)
+                ticket = tickets.popleft()
+                if tickets:
+                    clients[client] = tickets  # back of the rotation
+                ticket.granted = True
+                self.active += 1
+                self.waiting -= 1
+                break
+        self.cond.notify_all()
+
+    def acquire(self, client: str, priority: str, shed: bool):
+        with self.cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return
+            global _total_waiting
+            with _total_guard:
+                if shed and (
+                    self.waiting >= MAX_QUEUE * QUEUE_SHARE[priority]
+                    or _total_waiting >= MAX_WAITERS * QUEUE_SHARE[priority]
+                ):
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"{self.name} backend busy, retry later",
+                        headers={"Retry-After": str(self._retry_after())},
+                    )
+                _total_waiting += 1
+            ticket = _Ticket()
+            self.queues[PRIORITIES[priority]].setdefault(client, deque()).append(ticket)
+            self.waiting += 1
+            try:
+                while not ticket.granted:
+                    self.cond.wait()
+            finally:
+                with _total_guard:
+                    _total_waiting -= 1
+
+    def release(self, elapsed: float):
+        with self.cond:
+            self.active -= 1
+            self.avg_service = 0.8 * self.avg_service + 0.2 * elapsed
+            self._dispatch()
+
+
+_backends = {name: _Backend(name, limit) for name, limit in LIMITS.items()}
+
+
+def register_backend(name: str, limit: int):
+    """Add a backend with its own concurrency limit (idempotent)."""
+    if name not in _backends:
+        _backends[name] = _Backend(name, limit)
+
+
+def load(backend: str) -> Tuple[int, int, int]:
+    """(waiting, active, limit) for `backend`; a racy snapshot, good enough for routing."""
+    b = _backends[backend]
+    return b.waiting, b.active, b.limit
+
+
+@contextmanager
+def slot(backend: str):
+    """Hold one concurrency slot on `backend` for the duration of the block."""
+    b = _backends[backend]
+    client, priority, shed = _caller.get()
+    b.acquire(client, priority, shed)
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        b.release(time.monotonic() - start)
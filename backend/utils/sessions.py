@@ -0,0 +1,142 @@
+# backend/utils/sessions.py
+"""Session storage for branching stories.
+
+Sessions are stored compact (no indent), optionally gzip'd (SESSION_COMPRESS=gzip),
+and written atomically. Every save bumps `version` and records, per beat and
+per top-level field, the version at which it last changed; that is what lets
+GET /story/session answer ETag / If-None-Match and serve deltas.
+"""
+import gzip
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SESSIONS_DIR = os.path.normpath(os.path.join(HERE, "..", "data", "sessions"))
+COMPRESS = os.getenv("SESSION_COMPRESS", "").lower() == "gzip"
+
+# bookkeeping / server-only keys: never diffed, never sent to clients
+INTERNAL_KEYS = {"version", "beat_versions", "field_versions", "context"}
+
+_ID_RE = re.compile(r"^[0-9a-fA-F-]{1,64}$")
+
+
+def _paths(session_id: str):
+    if not _ID_RE.match(session_id):
+        raise HTTPException(404, "session not found")
+    base = os.path.join(SESSIONS_DIR, session_id)
+    return base + ".json", base + ".json.gz"
+
+
+def _read(session_id: str) -> Optional[Dict]:
+    plain, packed = _paths(session_id)
+    if os.path.exists(packed):
+        with gzip.open(packed, "rt", encoding="utf-8") as f:
+            return json.load(f)
+    if os.path.exists(plain):
+        with open(plain, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return None
+
+
+def load_session(session_id: str) -> Dict:
+    session = _read(session_id)
+    if session is None:
+        raise HTTPException(404, "session not found")
+    return session
+
+
+def save_session(session: Dict) -> Dict:
+    """Persist `session`, bumping its version and change markers. Returns it."""
+    os.makedirs(SESSIONS_DIR, exist_ok=True)
+    session_id = session["session_id"]
+    prev = _read(session_id) or {}
+    version = prev.get("version", 0) + 1
+
+    old_beats = prev.get("beats", [])
+    old_bv = prev.get("beat_versions", [])
+    session["beat_versions"] = [
+        old_bv[i] if i < len(old_beats) and i < len(old_bv) and old_beats[i] == beat else version
+        for i, beat in enumerate(session.get("beats", []))
+    ]
+    field_versions = dict(prev.get("field_versions", {}))
+    for key, value in session.items():
+        if key not in INTERNAL_KEYS and (key not in prev or prev[key] != value):
+            field_versions[key] = version
+    session["field_versions"] = field_versions
+    session["version"] = version
+
+    plain, packed = _paths(session_id)
+    target, stale = (packed, plain) if COMPRESS else (plain, packed)
+    tmp = target + ".tmp"
+    payload = json.dumps(session, ensure_ascii=False, separators=(",", ":"))
+    if COMPRESS:
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            f.write(payload)
+    else:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+    os.replace(tmp, target)  # readers never see a half-written session
+    if os.path.exists(stale):
+        os.remove(stale)
+    return session
+
+
+def public_view(session: Dict) -> Dict:
+    """Client-facing copy: no internal keys, image paths as /outputs URLs."""
+    out = {k: v for k, v in session.items() if k not in INTERNAL_KEYS}
+    if "images" in out:
+        out["images"] = [f"/outputs/{os.path.basename(p)}" for p in out["images"]]
+    out["version"] = session.get("version", 0)
+    return out
+
+
+_FIELD_RE = re.compile(r"^(\w+)(?:\[(-?\d*)(:?)(-?\d*)\])?$")
+
+
+def select_fields(view: Dict, fields: str) -> Dict:
+    """Apply a selector like "beats[3:],images,version" to a public view."""
+    out: Dict = {"version": view.get("version", 0)}
+    for spec in filter(None, (s.strip() for s in fields.split(","))):
+        m = _FIELD_RE.match(spec)
+        if not m or m.group(1) not in view:
+            raise HTTPException(400, f"bad field selector: {spec}")
+        name, start, colon, stop = m.groups()
+        value = view[name]
+        if spec.endswith("]"):
+            if not isinstance(value, list):
+                raise HTTPException(400, f"{name} is not a list")
+            lo = int(start) if start else None
+            if colon:
+                value = value[slice(lo, int(stop) if stop else None)]
+            elif lo is None or not -len(value) <= lo < len(value):
+                raise HTTPException(400, f"bad index in {spec}")
+            else:
+                value = value[lo]
+        out[spec if spec.endswith("]") else name] = value
+    return out
+
+
+def delta_since(session: Dict, since: int) -> Dict:
+    """Beats and top-level fields changed after version `since`."""
+    view = public_view(session)
+    beat_versions: List[int] = session.get("beat_versions", [])
+    beats = view.get("beats", [])
+    return {
+        "version": view["version"],
+        "since": since,
+        "beat_count": len(beats),
+        "beats": {
+            str(i): beat
+            for i, beat in enumerate(beats)
+            if (beat_versions[i] if i < len(beat_versions) else view["version"]) > since
+        },
+        "fields": {
+            k: view[k]
+            for k, v in session.get("field_versions", {}).items()
+            if v > since and k in view and k != "beats"
+        },
+    }
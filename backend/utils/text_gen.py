@@ -1,9 +1,14 @@
 # backend/utils/text_gen.py
 import os, requests, json
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+
+from utils.routing import Route, REQUEST_TIMEOUT, dispatch, pick_model
 
 OLLAMA_URL = os.getenv("OLLAMA_URL")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL")
+# Context window we ask Ollama for; unset means "model default" (assume 2048 for budgeting)
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "0")) or None
+# Stop reusing a stored context once it fills this share of the window
+CONTEXT_HEADROOM = 0.75
 
 SYSTEM_BEATS = (
     "You are a story outliner. Given a premise, produce N numbered scene beats.\n"
@@ -27,14 +32,43 @@ SYSTEM_UPGRADE = (
 ).strip()
 
 
-def _ollama(prompt: str) -> str:
-    r = requests.post(
-        OLLAMA_URL,
-        json={"model": OLLAMA_MODEL, "prompt": prompt, "stream": False},
-        timeout=120,
-    )
+def _post(route: Route, payload: Dict) -> Dict:
+    with dispatch(route):
+        r = requests.post(
+            OLLAMA_URL, json={"model": route.model, "stream": False, **payload}, timeout=REQUEST_TIMEOUT
+        )
     r.raise_for_status()
-    return r.json().get("response", "")
+    return r.json()
+
+
+def _ollama(prompt: str, call: str) -> str:
+    return _post(pick_model(call), {"prompt": prompt}).get("response", "")
+
+
+def _ollama_ctx(prompt: str, route: Route, context: Optional[List[int]] = None) -> Tuple[str, Optional[Dict]]:
+    """Like _ollama, but sends/returns Ollama's evaluated `context` tokens.
+
+    The returned entry records the model and window it was produced with so
+    callers can tell whether it is still valid (see _context_usable).
+    """
+    payload: Dict = {"prompt": prompt}
+    if OLLAMA_NUM_CTX:
+        payload["options"] = {"num_ctx": OLLAMA_NUM_CTX}
+    if context:
+        payload["context"] = context
+    data = _post(route, payload)
+    tokens = data.get("context")
+    entry = {"model": route.model, "num_ctx": OLLAMA_NUM_CTX, "tokens": tokens} if tokens else None
+    return data.get("response", ""), entry
+
+
+def _context_usable(entry: Optional[Dict], route: Route) -> bool:
+    """A stored context is only valid for the same model and context window."""
+    if not entry or not entry.get("tokens"):
+        return False
+    if entry.get("model") != route.model or entry.get("num_ctx") != OLLAMA_NUM_CTX:
+        return False
+    return len(entry["tokens"]) < (OLLAMA_NUM_CTX or 2048) * CONTEXT_HEADROOM
 
 
 def generate_beats(
@@ -44,37 +78,65 @@ def generate_beats(
     audience: Optional[str],
     scenes: int,
     guidance: Optional[str],
-) -> List[Dict]:
+) -> Tuple[List[Dict], Optional[Dict]]:
+    """Returns (beats, context); context is the Ollama state after producing these beats."""
     user = (
         f"{SYSTEM_BEATS}\n\n"
         f"Prompt: {prompt}\nGenre: {genre}\nTone: {tone}\nAudience: {audience}\nScenes: {scenes}\nGuidance: {guidance}"
     )
-    text = _ollama(user)
+    text, ctx = _ollama_ctx(user, pick_model("beats"))
     try:
         data = json.loads(text)
         assert isinstance(data, list)
-        return data
+        return data, ctx
     except Exception:
-        return [{"text": text.strip(), "choices": ["Continue", "Twist"]}]
+        # the context describes text we did not keep verbatim, so don't reuse it
+        return [{"text": text.strip(), "choices": ["Continue", "Twist"]}], None
 
 
-def continue_branch(base_beats: List[Dict], from_step: int, choice_idx: int) -> List[Dict]:
-    user = (
-        f"{SYSTEM_BRANCH}\n\n"
-        f"Base beats: {json.dumps(base_beats, ensure_ascii=False)}\n"
-        f"Branch from step: {from_step} pick choice index: {choice_idx}"
-    )
-    text = _ollama(user)
+def continue_branch(
+    base_beats: List[Dict],
+    from_step: int,
+    choice_idx: int,
+    context: Optional[Dict] = None,
+) -> Tuple[List[Dict], Optional[Dict]]:
+    """Returns (beats, context).
+
+    If `context` is the stored Ollama state for `base_beats` (same lineage, same
+    model/window) the beats are already evaluated on the server side, so we only
+    send the branch instruction instead of re-sending the whole story.
+    """
+    route = pick_model("branch")
+    text = None
+    ctx = None
+    if _context_usable(context, route):
+        user = (
+            f"{SYSTEM_BRANCH}\n\n"
+            f"Base beats: the latest JSON list above.\n"
+            f"Branch from step: {from_step} pick choice index: {choice_idx}"
+        )
+        try:
+            text, ctx = _ollama_ctx(user, route, context["tokens"])
+        except requests.HTTPError:
+            text = None  # context rejected (e.g. model reloaded) -> full prompt below
+
+    if text is None:
+        user = (
+            f"{SYSTEM_BRANCH}\n\n"
+            f"Base beats: {json.dumps(base_beats, ensure_ascii=False)}\n"
+            f"Branch from step: {from_step} pick choice index: {choice_idx}"
+        )
+        text, ctx = _ollama_ctx(user, route)
     try:
         data = json.loads(text)
         assert isinstance(data, list)
-        return data
+        return data, ctx
     except Exception:
-        return base_beats
+        return base_beats, context
 
 
 def ask_clarifiers(seed_prompt: str) -> List[str]:
-    text = _ollama(f"{SYSTEM_CLARIFIERS}\n\nSeed: {seed_prompt}")
+    text = _ollama(f"{SYSTEM_CLARIFIERS}\n\nSeed: {seed_prompt}", call="clarify")
     try:
         data = json.loads(text)
         assert isinstance(data, list)
@@ -85,4 +147,4 @@ def ask_clarifiers(seed_prompt: str) -> List[str]:
 
 def improve_prompt(seed_prompt: str, answers: List[str]) -> str:
     joined = " | ".join(answers)
-    return _ollama(f"{SYSTEM_UPGRADE}\n\nSeed: {seed_prompt}\nAnswers: {joined}")
+    return _ollama(f"{SYSTEM_UPGRADE}\n\nSeed: {seed_prompt}\nAnswers: {joined}", call="upgrade")
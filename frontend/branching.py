@@ -161,8 +161,10 @@ else:
         if c2.button("Export PDF"):
             r = requests.post(f"{API}/export/pdf", params={"session_id": session_id})
             if r.ok:
-                pdf_path = r.json().get("pdf")
-                st.success(f"PDF saved: {pdf_path}" if pdf_path else "PDF exported.")
+                url = r.json().get("url")
+                st.success("PDF exported.")
+                if url:
+                    st.markdown(f"[Download PDF]({API}{url})")
             else:
                 try:
                     st.error(f"PDF export failed: {r.json().get('detail')}")
@@ -172,8 +174,10 @@ else:
         if c3.button("Export Video"):
             r = requests.post(f"{API}/export/video", params={"session_id": session_id})
             if r.ok:
-                video_path = r.json().get("video")
-                st.success(f"Video saved: {video_path}" if video_path else "Video exported.")
+                url = r.json().get("url")
+                st.success("Video exported.")
+                if url:
+                    st.markdown(f"[Download video]({API}{url})")
             else:
                 try:
                     st.error(f"Video export failed: {r.json().get('detail')}")